@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import django_heroku
 import os
+import tempfile
 from pathlib import Path
 import dj_database_url
 
@@ -47,6 +48,8 @@ MIDDLEWARE = [
     # Simplified static file serving.
     # https://warehouse.python.org/project/whitenoise/
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    # latency of requests by view for /metrics
+    'pit.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,6 +57,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # SQL and template timings of requests, it is not used unless PIT_PERFORMANCE is set
+    'pit.middleware.PerformanceMiddleware',
 ]
 
 ROOT_URLCONF = 'openpit.urls'
@@ -87,6 +92,18 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# It is shared by all gunicorn workers, versions of pit data kept in it
+# invalidate process-local caches (see pit/versions.py)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('PIT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'openpit-cache')),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -152,3 +169,15 @@ GDAL_LIBRARY_PATH = '/app/.heroku/vendor/lib/libgdal.so' if os.environ.get('ENV'
 django_heroku.settings(locals())
 
 DATABASES['default']['ENGINE'] = 'django.contrib.gis.db.backends.postgis'
+
+# Timings of requests: Server-Timing headers and JSON lines of the pit.performance logger,
+# statements of requests slower than PIT_SLOW_REQUEST_MS go to the pit.performance.slow logger
+PIT_PERFORMANCE = os.getenv('PIT_PERFORMANCE') == '1'
+PIT_SLOW_REQUEST_MS = int(os.getenv('PIT_SLOW_REQUEST_MS', '500'))
+# django_heroku.settings() defines LOGGING unless it is called with logging=False
+LOGGING = locals().get('LOGGING') or {'version': 1, 'disable_existing_loggers': False}
+LOGGING.setdefault('handlers', {}).setdefault('console', {'class': 'logging.StreamHandler'})
+LOGGING.setdefault('loggers', {})['pit.performance'] = {'handlers': ['console'], 'level': 'INFO'}
+
+# Metrics of /metrics, every worker process writes its values to a file of the directory
+PIT_METRICS_DIR = os.getenv('PIT_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'openpit-metrics'))
@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models import QuerySet
+from django.http import HttpRequest
 from pit.models import (
     TruckModel,
     Truck,
@@ -9,10 +11,23 @@ from pit.models import (
 )
 
 
+class TripAdmin(admin.ModelAdmin):
+    """ Trips with the failed flag calculated for the whole page """
+    list_display = ('id', 'truck', 'mineral', 'storage', 'unloaded_at', 'failed')
+    list_select_related = ('truck__truck_model', 'mineral', 'storage')
+
+    def get_queryset(self, request: HttpRequest) -> QuerySet:
+        return super().get_queryset(request).with_failed()
+
+    @admin.display(boolean=True, ordering='unload_failed')
+    def failed(self, obj: Trip) -> bool:
+        return obj.failed
+
+
 # Register your models here.
 admin.site.register(TruckModel)
 admin.site.register(Truck)
 admin.site.register(Storage)
 admin.site.register(OtherStorageIncom)
 admin.site.register(Mineral)
-admin.site.register(Trip)
+admin.site.register(Trip, TripAdmin)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PitConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pit'
+
+    def ready(self) -> None:
+        import pit.signals  # noqa: F401 connects signal handlers
@@ -0,0 +1,219 @@
+"""
+Benchmarks of pit queries on synthetic data
+"""
+import json
+import math
+import random
+import subprocess
+import time
+from datetime import timedelta
+from io import StringIO
+from typing import Any, Callable, Dict, List, Optional
+from django.contrib.gis.geos import Point, Polygon
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from pit.models import Storage, Trip
+from pit.reports import legacy_storage_totals
+from pit.ingest import parse_events
+from pit.packed import encode, decode, decode_records
+from pit.synthetic import Scale, generate
+from pit.uploads import upload_rows
+from pit.versions import REPORT, bump_version
+from pit.views import Index, Report, UnloadEvents, UnloadPackedEvents
+
+
+def best_time(function: Callable[[], Any], repeat: int = 3) -> float:
+    """ returns the best time of function calls in seconds """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def report_benchmark(trip_counts: List[int], repeat: int = 3) -> List[Dict[str, Any]]:
+    """ compares the subquery based storage report query with
+    Storage.objects.with_quality_totals(), seeded data is rolled back
+    """
+    results = []
+    for trip_count in trip_counts:
+        with transaction.atomic():
+            generate(scale=Scale(truck_models=1, trucks=1, storages=10, trips=trip_count, other_incoms=1))
+            results.append({
+                'trips': trip_count,
+                'subqueries': best_time(legacy_storage_totals, repeat),
+                'with_quality_totals': best_time(
+                    lambda: list(Storage.objects.with_quality_totals()), repeat
+                ),
+            })
+            transaction.set_rollback(True)
+    return results
+
+
+def decode_benchmark(event_counts: List[int], repeat: int = 3) -> List[Dict[str, Any]]:
+    """ compares decoding of JSON and binary packed batches of unload events,
+    returns events per second, the database is not used.
+    'records' is decoding of packed records without creating points
+    """
+    rnd = random.Random(0)
+    results = []
+    for event_count in event_counts:
+        records = [
+            (rnd.randint(1, 1000), rnd.uniform(0, 1000), rnd.uniform(0, 1000), time.time())
+            for _ in range(event_count)
+        ]
+        payload = json.dumps({'events': [
+            {'truck_number': str(truck_id), 'x': x, 'y': y} for truck_id, x, y, _ in records
+        ]})
+        packed, packed_wkb = encode(records), encode(records, wkb=True)
+        results.append({
+            'events': event_count,
+            'json': event_count / best_time(lambda: parse_events(json.loads(payload)['events']), repeat),
+            'packed': event_count / best_time(lambda: decode(packed), repeat),
+            'packed_wkb': event_count / best_time(lambda: decode(packed_wkb), repeat),
+            'records': event_count / best_time(lambda: decode_records(packed), repeat),
+        })
+    return results
+
+
+def star(vertex_count: int, radius: float = 100) -> Polygon:
+    """ returns a star shaped polygon like an outline of a stockpile """
+    points = [
+        (radius * (1 if i % 2 else 0.6) * math.cos(2 * math.pi * i / vertex_count),
+         radius * (1 if i % 2 else 0.6) * math.sin(2 * math.pi * i / vertex_count))
+        for i in range(vertex_count)
+    ]
+    return Polygon(points + points[:1])
+
+
+def geometry_benchmark(vertex_counts: List[int], repeat: int = 3, point_count: int = 10000) -> List[Dict[str, Any]]:
+    """ compares covers() of a territory and of its prepared geometry for random points,
+    returns points per second, the database is not used
+    """
+    rnd = random.Random(0)
+    points = [Point(rnd.uniform(-100, 100), rnd.uniform(-100, 100)) for _ in range(point_count)]
+    results = []
+    for vertex_count in vertex_counts:
+        territory = star(vertex_count)
+        prepared = territory.prepared
+        results.append({
+            'vertices': vertex_count,
+            'geometry': point_count / best_time(lambda: [territory.covers(point) for point in points], repeat),
+            'prepared': point_count / best_time(lambda: [prepared.covers(point) for point in points], repeat),
+        })
+    return results
+
+
+def measure(function: Callable[[], Any], repeat: int = 3, rollback: bool = False) -> Dict[str, Any]:
+    """ returns the best time of function calls and the number of queries of a call,
+    with rollback every call runs in a transaction which is rolled back
+    """
+    def call() -> Any:
+        if not rollback:
+            return function()
+        with transaction.atomic():
+            function()
+            transaction.set_rollback(True)
+
+    with CaptureQueriesContext(connection) as queries:
+        call()
+    return {'seconds': best_time(call, repeat), 'queries': len(queries)}
+
+
+def active_trucks(count: int) -> List[Any]:
+    """ returns ids and numbers of trucks of the first active trips """
+    return list(Trip.objects.active().order_by('id').values_list('id', 'truck_id', 'truck__number')[:count])
+
+
+def views_benchmark(repeat: int = 3, batch: int = 500) -> Dict[str, Dict[str, Any]]:
+    """ times pages and ingestion paths on the current data and counts their queries,
+    writes are rolled back. Views are called directly, without middleware.
+    """
+    factory = RequestFactory()
+    index, report = Index.as_view(), Report.as_view()
+    page = active_trucks(50)
+    trucks = active_trucks(batch)
+    points = [Point(1050.0 + i % 10, 50.0) for i in range(len(trucks))]
+    formset = {
+        'form-TOTAL_FORMS': str(len(page)),
+        'form-INITIAL_FORMS': str(len(page)),
+        'form-MIN_NUM_FORMS': '0',
+        'form-MAX_NUM_FORMS': '1000',
+    }
+    for i, (trip_id, _, _) in enumerate(page):
+        formset.update({f'form-{i}-id': str(trip_id), f'form-{i}-xy': f'{1050 + i % 10} 50'})
+    events = json.dumps({'events': [
+        {'truck_number': number, 'x': point.x, 'y': point.y} for (_, _, number), point in zip(trucks, points)
+    ]})
+    packed = encode([(truck_id, point.x, point.y, None) for (_, truck_id, _), point in zip(trucks, points)])
+    lines = ''.join(f'{number},{point.x} {point.y}\n' for (_, _, number), point in zip(trucks, points))
+
+    def report_cold() -> Any:
+        bump_version(REPORT)
+        return report(factory.get('/report/'))
+
+    def failed() -> Any:
+        trips = list(Trip.objects.filter(unloading_point__isnull=False).with_failed().order_by('-id')[:1000])
+        return sum(trip.failed for trip in trips), Trip.objects.failed_unloads(
+            since=timezone.now() - timedelta(days=1)
+        ).count()
+
+    return {
+        'index_get': measure(lambda: index(factory.get('/')), repeat),
+        'report_get_cold': measure(report_cold, repeat),
+        'report_get_warm': measure(lambda: report(factory.get('/report/')), repeat),
+        'failed': measure(failed, repeat),
+        'formset_save': measure(lambda: index(factory.post('/', formset)), repeat, rollback=True),
+        'ingest_json': measure(
+            lambda: UnloadEvents.as_view()(factory.post('/api/unloads/', events, content_type='application/json')),
+            repeat, rollback=True,
+        ),
+        'ingest_packed': measure(
+            lambda: UnloadPackedEvents.as_view()(
+                factory.post('/api/unloads/packed/', packed, content_type='application/octet-stream')
+            ),
+            repeat, rollback=True,
+        ),
+        'upload_csv': measure(lambda: list(upload_rows(StringIO(lines))), repeat, rollback=True),
+    }
+
+
+def git_revision() -> Optional[str]:
+    """ returns the current commit of the working tree if git is available """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def views_report(repeat: int = 3, batch: int = 500) -> Dict[str, Any]:
+    """ returns results of views_benchmark() with the commit and sizes of the data for JSON """
+    return {
+        'commit': git_revision(),
+        'created_at': timezone.now().isoformat(),
+        'storages': Storage.objects.count(),
+        'trips': Trip.objects.count(),
+        'active_trips': Trip.objects.active().count(),
+        'results': views_benchmark(repeat, batch),
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    """ returns lines comparing two results of views_report() """
+    lines = []
+    for case, result in new['results'].items():
+        before = old.get('results', {}).get(case)
+        if before is None:
+            lines.append(f'{case}: {result["seconds"]:.4f}s, {result["queries"]} queries (new)')
+            continue
+        lines.append(
+            f'{case}: {before["seconds"]:.4f}s -> {result["seconds"]:.4f}s'
+            f' (x{result["seconds"] / before["seconds"]:.2f}),'
+            f' {before["queries"]} -> {result["queries"]} queries'
+        )
+    return lines
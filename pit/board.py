@@ -0,0 +1,44 @@
+"""
+Keyset pagination of active trips on the index page
+"""
+from typing import List, Optional
+from django.conf import settings
+from django.db.models import QuerySet
+
+BOARD_PAGE_SIZE = getattr(settings, 'PIT_BOARD_PAGE_SIZE', 50)
+
+
+def cursor(value: Optional[str]) -> Optional[int]:
+    """ returns a trip id from a query string value or None """
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+class BoardPage:
+    """ A page of trips after or before a trip id. Ids are compared with
+    the primary key index, so a page costs the same at any depth.
+    """
+
+    def __init__(self, trips: QuerySet, after: Optional[int] = None,
+                 before: Optional[int] = None, size: Optional[int] = None) -> None:
+        size = size or BOARD_PAGE_SIZE
+        if before is not None:
+            ids: List[int] = list(
+                trips.filter(id__lt=before).order_by('-id').values_list('id', flat=True)[:size + 1]
+            )
+            self.has_previous = len(ids) > size
+            self.has_next = True
+            ids = ids[:size][::-1]
+        else:
+            if after is not None:
+                trips = trips.filter(id__gt=after)
+            ids = list(trips.order_by('id').values_list('id', flat=True)[:size + 1])
+            self.has_previous = after is not None
+            self.has_next = len(ids) > size
+            ids = ids[:size]
+        self.ids = ids
+        self.trips = trips.filter(id__in=ids).order_by('id')
+        self.previous_before = ids[0] if self.has_previous and ids else None
+        self.next_after = ids[-1] if self.has_next and ids else None
@@ -0,0 +1,86 @@
+"""
+In-process catalog of truck models and trucks
+"""
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+from django.conf import settings
+from django.db import connection
+from pit.versions import CATALOG, get_version, mark_changed
+
+CHECK_INTERVAL = getattr(settings, 'PIT_CATALOG_CHECK_INTERVAL', 1.0)  # seconds between checks of the version
+
+
+class CatalogTruckModel(NamedTuple):
+    title: str
+    max_weight: int
+
+
+class CatalogTruck(NamedTuple):
+    number: str
+    truck_model_id: int
+
+
+class Catalog:
+    """ Process-local copy of truck models and models of trucks.
+    It is reloaded lazily when the catalog version changes, the version
+    is checked at most every CHECK_INTERVAL seconds.
+    Lookups return None when the catalog can not answer, callers walk FKs then.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._checked = 0.0
+        self._dirty = False
+        self._truck_models: Dict[int, CatalogTruckModel] = {}
+        self._trucks: Dict[int, CatalogTruck] = {}
+
+    def invalidate(self) -> None:
+        """ marks the catalog as changed in this process now and in all processes after commit """
+        self._dirty = True
+        mark_changed(CATALOG)
+
+    def _build(self) -> None:
+        from pit.models import TruckModel, Truck
+        self._truck_models = {
+            truck_model_id: CatalogTruckModel(title, max_weight)
+            for truck_model_id, title, max_weight in TruckModel.objects.values_list('id', 'title', 'max_weight')
+        }
+        self._trucks = {
+            truck_id: CatalogTruck(number, truck_model_id)
+            for truck_id, number, truck_model_id in Truck.objects.values_list('id', 'number', 'truck_model_id')
+        }
+
+    def _usable(self) -> bool:
+        """ reloads the catalog if needed, returns False while it can not be trusted """
+        if self._dirty and connection.in_atomic_block:
+            # changes of this process are pending in the transaction
+            return False
+        now = time.monotonic()
+        if not self._dirty and self._version is not None and now - self._checked < CHECK_INTERVAL:
+            return True
+        with self._lock:
+            version = get_version(CATALOG)
+            if self._dirty or version != self._version:
+                self._dirty = False
+                self._build()
+                self._version = version
+            self._checked = now
+        return True
+
+    def truck_model(self, truck_model_id: Optional[int]) -> Optional[CatalogTruckModel]:
+        """ returns the title and max_weight of the truck model """
+        return self._truck_models.get(truck_model_id) if self._usable() else None
+
+    def truck(self, truck_id: Optional[int]) -> Optional[CatalogTruck]:
+        """ returns the number and the model id of the truck """
+        return self._trucks.get(truck_id) if self._usable() else None
+
+    def truck_model_of(self, truck_id: Optional[int]) -> Optional[CatalogTruckModel]:
+        """ returns the title and max_weight of the model of the truck """
+        truck = self.truck(truck_id)
+        return truck and self.truck_model(truck.truck_model_id)
+
+
+catalog = Catalog()
@@ -5,6 +5,11 @@ from django.db.models.constraints import UniqueConstraint
 
 
 class IUniqueConstraint(UniqueConstraint):
+    """ Unique index on LOWER() of fields, use __lower_exact lookups to hit it.
+    condition, include and opclasses work as for UniqueConstraint,
+    opclasses apply to LOWER() expressions (e.g. text_pattern_ops for LIKE 'prefix%').
+    """
+
     def constraint_sql(self, model, schema_editor) -> str:
         return self.create_sql(model, schema_editor)
 
@@ -13,15 +18,22 @@ class IUniqueConstraint(UniqueConstraint):
             model._meta.get_field(field_name).column
             for field_name in self.fields
         ]
+        include = [
+            model._meta.get_field(field_name).column
+            for field_name in self.include
+        ]
         condition = self._get_condition_sql(model, schema_editor)  # type: ignore
-        if condition and not connection.features.support_partial_indexes:
+        if condition and not connection.features.supports_partial_indexes:
+            return ''
+        if self.include and not connection.features.supports_covering_indexes:
             return ''
         table = Table(model._meta.db_table, schema_editor.quote_name)
         name = schema_editor.quote_name(self.name)
+        opclasses = self.opclasses or [''] * len(fields)
         columns = ", ".join(
             map(
-                lambda x: f"LOWER({schema_editor.quote_name(x)})",
-                fields
+                lambda x: f"LOWER({schema_editor.quote_name(x[0])}) {x[1]}".rstrip(),
+                zip(fields, opclasses)
             )
         )
         statement = Statement(
@@ -31,10 +43,13 @@ class IUniqueConstraint(UniqueConstraint):
             columns=columns,
             condition=schema_editor._index_condition_sql(condition),
             deferrable=schema_editor._deferrable_constraint_sql(None),
-            include=schema_editor._index_include_sql(model, None),
+            include=schema_editor._index_include_sql(model, include),
         )
         if not hasattr(schema_editor, 'deferred_sql'):
             schema_editor.deferred_sql = []
         schema_editor.deferred_sql.append(statement)
         return ''
 
+    def remove_sql(self, model, schema_editor) -> str:
+        """ it is an index, not a table constraint """
+        return schema_editor._delete_constraint_sql(schema_editor.sql_delete_index, model, self.name)
@@ -0,0 +1,18 @@
+from django.db import models
+from django.db.models import Lookup
+
+
+@models.CharField.register_lookup
+@models.TextField.register_lookup
+class LowerExact(Lookup):
+    """ Case-insensitive equality that is compiled to LOWER(col) = LOWER(%s),
+    so it uses unique indexes of IUniqueConstraint on LOWER(col).
+    __iexact is compiled to UPPER(col::text) = UPPER(%s) by PostgreSQL
+    and is not able to use them.
+    """
+    lookup_name = 'lower_exact'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'LOWER({lhs}) = LOWER({rhs})', lhs_params + rhs_params
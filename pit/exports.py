@@ -0,0 +1,110 @@
+"""
+Streaming exports of pit data
+"""
+import csv
+import json
+from typing import Any, Dict, Iterable, Iterator, Sequence
+from pit.models import Trip, Storage
+from pit.reports import cached_storage_report
+from pit.spatial import territory_cache
+
+CHUNK_SIZE = 2000  # rows fetched from a server-side cursor and written at once
+
+TRIP_FIELDS = (
+    'id', 'truck_number', 'truck_model', 'truck_max_weight',
+    'weight', 'sio2', 'fe', 'x', 'y', 'storage', 'failed',
+)
+REPORT_FIELDS = ('title', 'weight_before', 'sum_weight_after', 'quality_after')
+STORAGE_FIELDS = ('title', 'wkb')  # the CSV is accepted by manage.py import_storages
+
+
+def trip_rows(chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """ yields finished trips with trucks, minerals and storages,
+    rows are read from a server-side cursor so memory does not grow with the table
+    """
+    trips = Trip.objects.filter(
+        unloading_point__isnull=False
+    ).select_related(
+        'truck__truck_model', 'mineral', 'storage'
+    ).order_by('id').iterator(chunk_size=chunk_size)
+    for trip in trips:
+        yield {
+            'id': trip.id,
+            'truck_number': trip.truck.number,
+            'truck_model': trip.truck.truck_model.title,
+            'truck_max_weight': trip.truck.truck_model.max_weight,
+            'weight': trip.mineral.weight,
+            'sio2': trip.mineral.sio2,
+            'fe': trip.mineral.fe,
+            'x': trip.unloading_point.x,
+            'y': trip.unloading_point.y,
+            'storage': trip.storage.title if trip.storage else None,
+            'failed': trip.storage_id is None,
+        }
+
+
+def report_rows(chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """ yields rows of the storage report, it has a row per storage so it is not chunked """
+    yield from cached_storage_report()
+
+
+def storage_rows(chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """ yields titles and hex EWKB of territories of storages,
+    territories come from the cache of parsed geometries
+    """
+    territories = territory_cache.load()
+    for storage_id, title in Storage.objects.order_by('id').values_list('id', 'title'):
+        territory = territories.get(storage_id)
+        if territory:
+            yield {'title': title, 'wkb': territory.geometry.hexewkb.decode()}
+
+
+class Echo:
+    """ A file-like object which returns what is written to it """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def chunked(lines: Iterable[str], chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """ joins lines into chunks so a response is not written line by line """
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def csv_lines(rows: Iterable[Dict[str, Any]], fields: Sequence[str]) -> Iterator[str]:
+    """ yields CSV lines of the rows with a header """
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([row[field] for field in fields])
+
+
+def ndjson_lines(rows: Iterable[Dict[str, Any]], fields: Sequence[str]) -> Iterator[str]:
+    """ yields newline delimited JSON lines of the rows """
+    for row in rows:
+        yield json.dumps({field: row[field] for field in fields}, ensure_ascii=False) + '\n'
+
+
+DATASETS = {
+    'trips': (trip_rows, TRIP_FIELDS),
+    'report': (report_rows, REPORT_FIELDS),
+    'storages': (storage_rows, STORAGE_FIELDS),
+}
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
+
+
+def export(dataset: str, fmt: str, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """ yields chunks of the dataset ('trips', 'report' or 'storages') in the format ('csv' or 'ndjson') """
+    rows, fields = DATASETS[dataset]
+    lines, _ = FORMATS[fmt]
+    return chunked(lines(rows(chunk_size), fields), chunk_size)
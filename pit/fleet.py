@@ -0,0 +1,108 @@
+"""
+Bulk import of trucks of a fleet with their models
+"""
+import csv
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from pit.catalog import catalog
+from pit.models import TruckModel, Truck
+
+Source = Tuple[str, Any, Any, Any]  # position, truck number, title of the truck model, max weight of the model
+Conflict = Tuple[str, str, str]  # position, truck number or title of the model, description
+Row = Tuple[str, str, str, int]  # position, truck number, title of the truck model, max weight of the model
+
+
+def key(value: str) -> str:
+    """ case folding of unique keys, it matches LOWER() of IUniqueConstraint indexes """
+    return value.lower()
+
+
+def read_sources(lines: Iterable[str]) -> Iterator[Source]:
+    """ yields rows of CSV: truck number, title of the truck model, max weight """
+    reader = csv.reader(lines)
+    for row in reader:
+        if not any(cell.strip() for cell in row) or (reader.line_num == 1 and row[0].strip().lower() == 'number'):
+            continue
+        yield (f'line {reader.line_num}', *(row + [''] * 3)[:3])
+
+
+def parse_row(position: str, number: Any, title: Any, max_weight: Any) -> Row:
+    """ returns a valid row, raises ValueError otherwise """
+    number = str(number if number is not None else '').strip()
+    title = str(title if title is not None else '').strip()
+    if not number or len(number) > Truck._meta.get_field('number').max_length:
+        raise ValueError('Truck number is required, up to 20 characters')
+    if not title or len(title) > TruckModel._meta.get_field('title').max_length:
+        raise ValueError('Truck model title is required, up to 60 characters')
+    try:
+        weight = int(max_weight)
+    except (TypeError, ValueError):
+        raise ValueError(f'Max weight "{max_weight}" is not an integer')
+    if weight <= 0:
+        raise ValueError('Max weight must be positive')
+    return position, number, title, weight
+
+
+def check_fleet(sources: Iterable[Source]) -> Tuple[List[Truck], List[TruckModel], List[Conflict]]:
+    """ returns new trucks, new truck models and every conflict.
+    Numbers and titles are case folded in memory and checked against
+    existing ones with one IN query on LOWER() for trucks and one for models
+    """
+    rows: List[Row] = []
+    conflicts: List[Conflict] = []
+    numbers: Dict[str, str] = {}  # key of a number: position
+    models: Dict[str, Row] = {}  # key of a title: first row of the model
+    for source in sources:
+        try:
+            row = parse_row(*source)
+        except ValueError as e:
+            conflicts.append((source[0], str(source[1] or ''), str(e)))
+            continue
+        position, number, title, weight = row
+        if key(number) in numbers:
+            conflicts.append((position, number, f'Repeats the truck number of {numbers[key(number)]}'))
+            continue
+        numbers[key(number)] = position
+        model = models.setdefault(key(title), row)
+        if model[3] != weight:
+            conflicts.append((position, title, f'Max weight {weight} differs from {model[3]} of {model[0]}'))
+        rows.append(row)
+    existing_numbers = Truck.objects.annotate(key=Lower('number')).filter(key__in=list(numbers))
+    for number in existing_numbers.values_list('number', flat=True):
+        conflicts.append((numbers.get(key(number), ''), number, 'A truck with the number exists'))
+    truck_models = {
+        key(truck_model.title): truck_model
+        for truck_model in TruckModel.objects.annotate(key=Lower('title')).filter(key__in=list(models))
+    }
+    for model_key, (position, _, title, weight) in models.items():
+        if model_key in truck_models and truck_models[model_key].max_weight != weight:
+            conflicts.append((position, title,
+                              f'The model exists with max weight {truck_models[model_key].max_weight}'))
+    new_models = []
+    for model_key, (_, _, title, weight) in models.items():
+        if model_key not in truck_models:
+            truck_models[model_key] = TruckModel(title=title, max_weight=weight)
+            new_models.append(truck_models[model_key])
+    trucks = [Truck(number=number, truck_model=truck_models[key(title)]) for _, number, title, _ in rows]
+    return trucks, new_models, conflicts
+
+
+def import_fleet(sources: Iterable[Source]) -> Tuple[List[Truck], List[TruckModel], List[Conflict]]:
+    """ creates trucks and their new models with bulk_create if there are no conflicts,
+    returns created trucks, created models and conflicts.
+    Unique indexes still guard against concurrent imports.
+    """
+    trucks, truck_models, conflicts = check_fleet(sources)
+    if conflicts:
+        return [], [], conflicts
+    try:
+        with transaction.atomic():
+            TruckModel.objects.bulk_create(truck_models)
+            for truck in trucks:
+                truck.truck_model_id = truck.truck_model.id  # ids of created models
+            Truck.objects.bulk_create(trucks)
+            catalog.invalidate()
+    except IntegrityError as e:
+        return [], [], [('', '', f'Concurrent changes of the fleet: {e}')]
+    return trucks, truck_models, []
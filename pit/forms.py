@@ -1,9 +1,11 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 from django import forms
 from django.core.exceptions import ValidationError
-from django.forms.models import modelformset_factory
+from django.db.models import QuerySet
+from django.forms.models import BaseModelFormSet, modelformset_factory
 from django.forms.utils import ErrorList
-from pit.models import Trip
+from pit.models import Trip, TruckModel, xy_point
+from pit.unloads import UnloadConflict, record_unloads
 import pit.patterns as patterns
 
 
@@ -92,7 +94,66 @@ class TripIndexPageForm(forms.ModelForm):
         )
 
 
+class BaseTripIndexPageFormSet(BaseModelFormSet):
+    """ The formset of a page of active trips """
+
+    def clean(self) -> None:
+        """ every posted trip must still be active """
+        super().clean()
+        for form in self.forms:
+            if form.instance.pk is None:
+                raise ValidationError(
+                    'Some trips are already unloaded, reload the page'
+                )
+
+    def bulk_save(self) -> List[Trip]:
+        """ saves unloads of all changed forms with one bulk_update,
+        returns unloaded trips or adds an error and returns nothing
+        if a trip was unloaded by somebody else after validation
+        """
+        unloads = [
+            (form.instance.id, xy_point(form.cleaned_data['xy']), None)
+            for form in self.forms if form.has_changed()
+        ]
+        try:
+            trips, _ = record_unloads(unloads)
+        except UnloadConflict:
+            self._non_form_errors.append('Some trips are already unloaded, reload the page')
+            return []
+        return trips
+
+
 TripIndexPageFormSet = modelformset_factory(model=Trip,
                                             form=TripIndexPageForm,
+                                            formset=BaseTripIndexPageFormSet,
                                             exclude=(),
                                             extra=0)
+
+
+class TripBoardFilterForm(forms.Form):
+    """ Filters of active trips on the index page """
+    truck_model = forms.ModelChoiceField(queryset=TruckModel.objects.order_by('title'),
+                                         required=False,
+                                         label='Модель')
+    number = forms.CharField(required=False,
+                             max_length=20,
+                             label='Бортовой номер начинается с')
+    overloaded = forms.BooleanField(required=False,
+                                    label='Только с перегрузом')
+
+    def filter(self, trips: QuerySet) -> QuerySet:
+        """ returns trips of Trip.objects.dashboard() matching the filters """
+        if not self.is_valid():
+            return trips
+        if self.cleaned_data['truck_model']:
+            trips = trips.filter(truck__truck_model=self.cleaned_data['truck_model'])
+        if self.cleaned_data['number']:
+            trips = trips.filter(truck__number__istartswith=self.cleaned_data['number'])
+        if self.cleaned_data['overloaded']:
+            trips = trips.filter(dashboard_overload__gt=0)
+        return trips
+
+
+class UnloadsUploadForm(forms.Form):
+    """ CSV file of unloads of a shift """
+    file = forms.FileField(label='CSV файл (бортовой номер, координаты разгрузки x y)')
@@ -0,0 +1,105 @@
+"""
+Ingestion of unload events reported by onboard units of trucks
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from django.contrib.gis.geos import Point
+from django.db.models.functions import Lower
+from pit.models import Trip, xy_point
+from pit.unloads import record_unloads
+
+TruckKey = Union[str, int]  # truck number or truck id
+TruckUnload = Tuple[TruckKey, Point, Optional[datetime]]
+Results = List[Optional[Dict[str, Any]]]  # None in places of events waiting for unloading
+
+
+def parse_event(event: Any) -> Tuple[str, Point]:
+    """ returns the truck number and the unloading point of a JSON event
+    {"truck_number": ..., "x": ..., "y": ...}, coordinates follow patterns.XY
+    """
+    if not isinstance(event, dict):
+        raise ValueError('An event must be an object')
+    number = event.get('truck_number')
+    if isinstance(number, bool) or not isinstance(number, (str, int)) or str(number) == '':
+        raise ValueError('truck_number is required')
+    for name in ('x', 'y'):
+        if isinstance(event.get(name), bool) or not isinstance(event.get(name), (str, int, float)):
+            raise ValueError(f'{name} must be a number')
+    return str(number), xy_point(f'{event["x"]} {event["y"]}')
+
+
+def active_trips_of_trucks(keys: Sequence[TruckKey], by: str = 'number') -> Dict[TruckKey, int]:
+    """ returns ids of active trips by truck numbers (ignore case) or truck ids with one query """
+    trips = Trip.objects.active()
+    if by == 'number':
+        rows = trips.annotate(
+            truck_key=Lower('truck__number')
+        ).filter(
+            truck_key__in={str(key).lower() for key in keys}
+        ).values_list('truck_key', 'id')
+    else:
+        rows = trips.filter(truck_id__in=set(keys)).values_list('truck_id', 'id')
+    return dict(rows)
+
+
+def unload_trucks(events: Sequence[TruckUnload], by: str = 'number') -> List[Dict[str, Any]]:
+    """ unloads active trips of trucks in one transaction,
+    returns a result for every event in the same order
+    """
+    trips = active_trips_of_trucks([key for key, _, _ in events], by)
+    results: List[Dict[str, Any]] = []
+    unloads = []
+    seen = set()
+    for key, point, unloaded_at in events:
+        trip_id = trips.get(str(key).lower() if by == 'number' else key)
+        if trip_id is None:
+            results.append({'status': 'error', 'error': f'Truck {key} has no active trip'})
+        elif trip_id in seen:
+            results.append({'status': 'error', 'error': f'Truck {key} is unloaded twice in the batch'})
+        else:
+            seen.add(trip_id)
+            results.append({'status': 'ok', 'trip': trip_id})
+            unloads.append((trip_id, point, unloaded_at))
+    unloaded, skipped = record_unloads(unloads, strict=False)
+    failed = {trip.id: trip.storage_id is None for trip in unloaded}
+    for result in results:
+        if 'trip' not in result:
+            continue
+        if result['trip'] in skipped:
+            result.update(status='error', error=f'Trip {result["trip"]} is not active')
+        else:
+            result['failed'] = failed[result['trip']]
+    return results
+
+
+def parse_events(events: Sequence[Any], unloaded_at: Optional[datetime] = None) -> Tuple[Results, List[TruckUnload]]:
+    """ validates JSON events, returns errors of invalid events (None in places of valid ones)
+    and unloads of valid events
+    """
+    results: Results = []
+    valid: List[TruckUnload] = []
+    for event in events:
+        try:
+            number, point = parse_event(event)
+        except ValueError as e:
+            results.append({'status': 'error', 'error': str(e)})
+        else:
+            results.append(None)
+            valid.append((number, point, unloaded_at))
+    return results, valid
+
+
+def merge_results(results: Results, unloaded: Iterator[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """ fills places of valid events with results of unloading, numbers results """
+    return [
+        {'index': i, **(result or next(unloaded))}
+        for i, result in enumerate(results)
+    ]
+
+
+def ingest_json_events(events: Sequence[Any]) -> List[Dict[str, Any]]:
+    """ validates JSON events and unloads trips of valid ones,
+    returns a result for every event in the same order
+    """
+    results, valid = parse_events(events)
+    return merge_results(results, iter(unload_trucks(valid)))
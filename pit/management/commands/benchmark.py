@@ -0,0 +1,86 @@
+import json
+from django.core.management.base import BaseCommand
+from pit.benchmarks import report_benchmark, decode_benchmark, geometry_benchmark, views_report, compare
+
+
+class Command(BaseCommand):
+    """ Runs benchmarks """
+    help = 'Runs benchmarks of pit queries on synthetic data, the data is rolled back. ' \
+           'The views suite runs on the current data (see manage.py generate_pit_data)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=['report', 'decode', 'geometry', 'views'])
+        parser.add_argument(
+            '--trips',
+            type=int,
+            nargs='+',
+            default=[10000, 100000, 1000000],
+            help='Numbers of finished trips to benchmark with',
+        )
+        parser.add_argument(
+            '--events',
+            type=int,
+            nargs='+',
+            default=[10000, 100000],
+            help='Numbers of unload events in a batch to benchmark decoding with',
+        )
+        parser.add_argument(
+            '--vertices',
+            type=int,
+            nargs='+',
+            default=[100, 1000, 10000],
+            help='Numbers of vertices of territories to benchmark prepared geometries with',
+        )
+        parser.add_argument('--batch', type=int, default=500, help='Unload events in a batch of the views suite')
+        parser.add_argument('--output', help='JSON file for results of the views suite')
+        parser.add_argument('--compare', help='JSON file of earlier results of the views suite')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            if options['suite'] == 'views':
+                report = views_report(options['repeat'], options['batch'])
+                if options['output']:
+                    with open(options['output'], 'w', encoding='utf-8') as output:
+                        json.dump(report, output, indent=2)
+                if options['compare']:
+                    with open(options['compare'], encoding='utf-8') as earlier:
+                        lines = compare(json.load(earlier), report)
+                else:
+                    lines = [
+                        f'{case}: {result["seconds"]:.4f}s, {result["queries"]} queries'
+                        for case, result in report['results'].items()
+                    ]
+                for line in lines:
+                    self.stdout.write(line)
+                return
+            if options['suite'] == 'geometry':
+                for result in geometry_benchmark(options['vertices'], options['repeat']):
+                    self.stdout.write(
+                        f'{result["vertices"]:>9} vertices:'
+                        f' geometry {result["geometry"]:.0f} points/s,'
+                        f' prepared {result["prepared"]:.0f} points/s'
+                    )
+                return
+            if options['suite'] == 'decode':
+                for result in decode_benchmark(options['events'], options['repeat']):
+                    self.stdout.write(
+                        f'{result["events"]:>9} events:'
+                        f' json {result["json"]:.0f}/s,'
+                        f' packed {result["packed"]:.0f}/s,'
+                        f' packed_wkb {result["packed_wkb"]:.0f}/s,'
+                        f' records {result["records"]:.0f}/s'
+                    )
+                return
+            for result in report_benchmark(options['trips'], options['repeat']):
+                self.stdout.write(
+                    f'{result["trips"]:>9} trips:'
+                    f' subqueries {result["subqueries"]:.3f}s,'
+                    f' with_quality_totals {result["with_quality_totals"]:.3f}s'
+                )
+        except Exception as e:
+            self.stderr.write(
+                self.style.ERROR(
+                    f'An error has occurred: {e}'
+                )
+            )
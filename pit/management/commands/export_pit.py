@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from pit.exports import CHUNK_SIZE, DATASETS, FORMATS, export
+
+
+class Command(BaseCommand):
+    """ Exports pit data """
+    help = 'Streams finished trips or the storage report as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write, stdout by default')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            chunks = export(options['dataset'], options['format'], options['chunk_size'])
+            if options['output']:
+                with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                    output.writelines(chunks)
+            else:
+                for chunk in chunks:
+                    self.stdout.write(chunk, ending='')
+        except Exception as e:
+            self.stderr.write(
+                self.style.ERROR(
+                    f'An error has occurred: {e}'
+                )
+            )
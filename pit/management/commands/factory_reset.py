@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from pit.synthetic import SCALES
 from pit.utils import factory_reset
 
 
@@ -6,9 +7,18 @@ class Command(BaseCommand):
     """ Makes factory reset """
     help = 'Resets all data to default values'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=list(SCALES), help='Adds synthetic data of the scale')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of synthetic data')
+        parser.add_argument('--keep-admin', action='store_true', help='Keeps users')
+
     def handle(self, *args, **options):
         try:
-            factory_reset()
+            factory_reset(
+                reset_admin=not options['keep_admin'],
+                scale=SCALES[options['scale']] if options['scale'] else None,
+                seed=options['seed'],
+            )
             self.stdout.write(
                 self.style.SUCCESS(
                     'All data was reset to default'
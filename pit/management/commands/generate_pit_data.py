@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from pit.synthetic import SCALES, generate
+
+
+class Command(BaseCommand):
+    """ Generates synthetic pit data """
+    help = 'Adds reproducible synthetic truck models, trucks, storages, not trip incoms and trips'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scale', choices=list(SCALES), default='small')
+        parser.add_argument('--trips', type=int, help='Numbers of finished trips instead of the one of the scale')
+
+    def handle(self, *args, **options):
+        try:
+            scale = SCALES[options['scale']]
+            if options['trips'] is not None:
+                scale = scale._replace(trips=options['trips'])
+            counts = generate(options['seed'], scale)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    'Created ' + ', '.join(f'{count} {name}' for name, count in counts.items())
+                )
+            )
+        except Exception as e:
+            self.stderr.write(
+                self.style.ERROR(
+                    f'An error has occurred: {e}'
+                )
+            )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from pit.fleet import import_fleet, read_sources
+
+
+class Command(BaseCommand):
+    """ Imports a fleet """
+    help = 'Imports trucks from CSV: number, title of the truck model, max weight. ' \
+           'New truck models are created, nothing is imported if there are conflicts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                trucks, truck_models, conflicts = import_fleet(read_sources(lines))
+            for position, value, description in conflicts:
+                self.stdout.write(f'{position}: {value}: {description}')
+            if conflicts:
+                self.stderr.write(self.style.ERROR(f'{len(conflicts)} conflicts, nothing is imported'))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f'{len(trucks)} trucks and {len(truck_models)} truck models are imported'
+                ))
+        except Exception as e:
+            self.stderr.write(
+                self.style.ERROR(
+                    f'An error has occurred: {e}'
+                )
+            )
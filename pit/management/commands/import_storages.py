@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from pit.storage_import import FORMATS, file_format, import_storages
+
+
+class Command(BaseCommand):
+    """ Imports storages """
+    help = 'Imports storages from GeoJSON or WKB, nothing is imported if there are conflicts. ' + \
+           ' '.join(f'{fmt}: {description}.' for fmt, description in FORMATS.items())
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(FORMATS), help='By the extension of the file by default')
+
+    def handle(self, *args, **options):
+        try:
+            fmt = options['format'] or file_format(options['path'])
+            if fmt is None:
+                raise ValueError('Unknown format of the file, use --format')
+            with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                storages, conflicts = import_storages(lines, fmt)
+            for position, title, description in conflicts:
+                self.stdout.write(f'{position}: {title}: {description}')
+            if conflicts:
+                self.stderr.write(self.style.ERROR(f'{len(conflicts)} conflicts, nothing is imported'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{len(storages)} storages are imported'))
+        except Exception as e:
+            self.stderr.write(
+                self.style.ERROR(
+                    f'An error has occurred: {e}'
+                )
+            )
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from pit.models import StorageTotal
+from pit.reports import storage_totals_mismatches
+
+
+class Command(BaseCommand):
+    """ Rebuilds running totals of storages """
+    help = 'Rebuilds running totals of storages from scratch and checks them against the report query'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-check',
+            action='store_true',
+            help='Do not compare rebuilt totals with the report query',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                StorageTotal.objects.rebuild()
+            mismatches = [] if options['no_check'] else storage_totals_mismatches()
+            for mismatch in mismatches:
+                self.stderr.write(self.style.ERROR(mismatch))
+            if mismatches:
+                self.stderr.write(
+                    self.style.ERROR(
+                        f'Running totals differ from the report query for {len(mismatches)} storages'
+                    )
+                )
+            else:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        'Running totals of storages were rebuilt'
+                    )
+                )
+        except Exception as e:
+            self.stderr.write(
+                self.style.ERROR(
+                    f'An error has occurred: {e}'
+                )
+            )
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from pit.snapshots import create_snapshot, delete_snapshot, list_snapshots, restore_snapshot
+
+
+class Command(BaseCommand):
+    """ Manages snapshots of pit data """
+    help = 'Lists, creates, restores or deletes named snapshots of pit tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'create', 'restore', 'delete'])
+        parser.add_argument('name', nargs='?')
+        parser.add_argument('--replace', action='store_true', help='Replaces an existing snapshot on create')
+
+    def handle(self, *args, **options):
+        try:
+            action, name = options['action'], options['name']
+            if action == 'list':
+                for snapshot in list_snapshots():
+                    rows = ', '.join(f'{count} {model}' for model, count in snapshot.get('rows', {}).items())
+                    self.stdout.write(
+                        f'{snapshot["name"]}: {snapshot.get("created_at")}, {snapshot.get("migration")}, {rows}'
+                    )
+                return
+            if not name:
+                raise ValueError(f'A name of the snapshot is required to {action} it')
+            if action == 'create':
+                create_snapshot(name, replace=options['replace'])
+            elif action == 'restore':
+                restore_snapshot(name)
+            else:
+                delete_snapshot(name)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Snapshot {name}: {action} is done'
+                )
+            )
+        except Exception as e:
+            self.stderr.write(
+                self.style.ERROR(
+                    f'An error has occurred: {e}'
+                )
+            )
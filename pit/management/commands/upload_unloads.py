@@ -0,0 +1,35 @@
+import csv
+from django.core.management.base import BaseCommand
+from pit.uploads import UPLOAD_CHUNK_SIZE, UploadReport, upload_rows
+
+
+class Command(BaseCommand):
+    """ Uploads unloads of a shift """
+    help = 'Unloads active trips by a CSV file of truck numbers and "x y" unloading points, ' \
+           'writes rows with errors as CSV: line, truck number, error'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file: truck number, "x y"')
+        parser.add_argument('--chunk-size', type=int, default=UPLOAD_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            report = UploadReport(errors_limit=0)
+            errors = csv.writer(self.stdout, lineterminator='\n')
+            with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                for line, number, result in upload_rows(lines, options['chunk_size']):
+                    report.add(line, number, result)
+                    if result['status'] == 'error':
+                        errors.writerow([line, number, result['error']])
+            self.stderr.write(
+                self.style.SUCCESS(
+                    f'{report.rows} rows: {report.unloaded} trips unloaded'
+                    f' ({report.failed} out of storages), {report.error_count} errors'
+                )
+            )
+        except Exception as e:
+            self.stderr.write(
+                self.style.ERROR(
+                    f'An error has occurred: {e}'
+                )
+            )
@@ -0,0 +1,312 @@
+"""
+Prometheus metrics of pit shared by worker processes through files.
+Every process keeps its values in memory and saves them to its own file
+of PIT_METRICS_DIR at most every PIT_METRICS_SAVE_INTERVAL seconds and at exit.
+The /metrics page folds files of dead processes into the aggregate file,
+so counts of restarted workers are kept while the number of files stays
+at the number of live workers, and sums the files, no collector process is needed.
+Processes are recognized by pids, so the directory must be local to the host
+"""
+import atexit
+import fcntl
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from django.conf import settings
+
+logger = logging.getLogger('pit.metrics')
+METRICS_DIR = getattr(settings, 'PIT_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'openpit-metrics'))
+SAVE_INTERVAL = getattr(settings, 'PIT_METRICS_SAVE_INTERVAL', 1.0)  # seconds, 0 saves every change
+AGGREGATE = 'aggregate.json'  # values of dead processes
+LOCK = 'aggregate.lock'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+
+
+class Metric(NamedTuple):
+    kind: str  # 'counter' or 'histogram'
+    help: str
+    labels: Tuple[str, ...] = ()
+    buckets: Tuple[float, ...] = LATENCY_BUCKETS
+
+
+REQUEST_DURATION = 'pit_request_duration_seconds'
+UNLOADS = 'pit_unloads_total'
+FAILED_UNLOADS = 'pit_failed_unloads_total'
+OVERLOADS = 'pit_overloads_total'
+REPORT_RECOMPUTE = 'pit_report_recompute_seconds'
+
+METRICS: Dict[str, Metric] = {
+    REQUEST_DURATION: Metric('histogram', 'Latency of requests by view', labels=('view',)),
+    UNLOADS: Metric('counter', 'Unloaded trips'),
+    FAILED_UNLOADS: Metric('counter', 'Trips unloaded outside of storages'),
+    OVERLOADS: Metric('counter', 'Unloaded trips with mineral over max weight of the truck'),
+    REPORT_RECOMPUTE: Metric('histogram', 'Time of calculation of the storage report on a cache miss'),
+}
+
+
+def labels_key(labels: Dict[str, str]) -> str:
+    """ returns the key of values of the labels in a metric """
+    return json.dumps(labels, sort_keys=True)
+
+
+def empty_value(metric: Metric) -> Any:
+    if metric.kind == 'counter':
+        return 0.0
+    return {'buckets': [0] * (len(metric.buckets) + 1), 'sum': 0.0, 'count': 0}
+
+
+def add_value(metric: Metric, total: Any, value: Any) -> Any:
+    """ returns the sum of values of the metric from two processes """
+    if metric.kind == 'counter':
+        return total + value
+    return {
+        'buckets': [a + b for a, b in zip(total['buckets'], value['buckets'])],
+        'sum': total['sum'] + value['sum'],
+        'count': total['count'] + value['count'],
+    }
+
+
+Values = Dict[str, Dict[str, Any]]  # values by labels keys by names of metrics
+
+
+def merge_values(totals: Values, values: Values) -> Values:
+    """ adds values of a process to totals, unknown metrics are skipped """
+    for name, metric_values in values.items():
+        metric = METRICS.get(name)
+        if metric is None:
+            continue
+        metric_totals = totals.setdefault(name, {})
+        for key, value in metric_values.items():
+            metric_totals[key] = add_value(metric, metric_totals.get(key, empty_value(metric)), value)
+    return totals
+
+
+def process_id(file_name: str) -> Optional[int]:
+    """ returns the pid of a file of a process named <pid>-<random>.json """
+    if not file_name.endswith('.json'):
+        return None
+    try:
+        return int(file_name.split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_json(path: str) -> Any:
+    """ returns the content of a JSON file or None if it is missing or broken """
+    try:
+        with open(path, encoding='utf-8') as source:
+            return json.load(source)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path: str, data: Any) -> None:
+    """ writes a JSON file, readers never see a partly written file """
+    with open(f'{path}.{os.getpid()}.tmp', 'w', encoding='utf-8') as output:
+        json.dump(data, output)
+    os.replace(f'{path}.{os.getpid()}.tmp', path)
+
+
+class MetricsStore:
+    """ Values of metrics of this process, saved to the file of the process
+    save_interval seconds after the first unsaved change and at exit.
+    A forked process starts with empty values and a file of its own
+    """
+
+    def __init__(self, directory: str = METRICS_DIR, save_interval: float = SAVE_INTERVAL):
+        self.directory = directory
+        self.save_interval = save_interval
+        self._start()
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self) -> None:
+        """ starts values of this process, the lock may be held by a thread of the parent """
+        self._lock = threading.Lock()
+        self._path = os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        self._values: Values = {}
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+
+    def _changed(self) -> None:
+        """ schedules saving of changed values, it is called with the lock held """
+        self._dirty = True
+        if self.save_interval <= 0:
+            self._save()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.save_interval, self.save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _save(self) -> None:
+        """ writes values of the process.
+        Metrics are written after the work is done, so a failed write is only logged
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            write_json(self._path, self._values)
+            self._dirty = False
+        except OSError as e:
+            logger.warning(f'Metrics are not saved to {self._path}: {e}')
+
+    def save(self) -> None:
+        """ writes values of the process if they changed since the last write """
+        with self._lock:
+            self._timer = None
+            if self._dirty:
+                self._save()
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        """ increments a counter """
+        if not amount:
+            return
+        with self._lock:
+            values = self._values.setdefault(name, {})
+            key = labels_key(labels)
+            values[key] = values.get(key, 0.0) + amount
+            self._changed()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """ adds an observation to a histogram """
+        metric = METRICS[name]
+        with self._lock:
+            values = self._values.setdefault(name, {})
+            histogram = values.setdefault(labels_key(labels), empty_value(metric))
+            histogram['buckets'][bisect_left(metric.buckets, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+            self._changed()
+
+    @contextmanager
+    def _directory_lock(self) -> Iterator[None]:
+        """ serializes readers and folding of files between processes """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _fold_dead(self, names: List[str]) -> Dict[str, Any]:
+        """ adds files of dead processes to the aggregate file and removes them,
+        the aggregate lists folded files, so a file left by a failed removal is not added twice.
+        Returns the aggregate
+        """
+        aggregate_path = os.path.join(self.directory, AGGREGATE)
+        aggregate = read_json(aggregate_path) or {'values': {}, 'folded': []}
+        folded = [name for name in aggregate['folded'] if name in names]
+        dead = [
+            name for name in names
+            if name not in folded and process_id(name) is not None and not process_alive(process_id(name))
+        ]
+        if dead or len(folded) != len(aggregate['folded']):
+            for name in dead:
+                merge_values(aggregate['values'], read_json(os.path.join(self.directory, name)) or {})
+            aggregate['folded'] = folded + dead
+            write_json(aggregate_path, aggregate)
+        for name in aggregate['folded']:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+        return aggregate
+
+    def collect(self) -> Values:
+        """ returns values of metrics summed over the aggregate and files of live processes,
+        metrics without labels have a zero value before the first change
+        """
+        self.save()
+        totals: Values = {
+            name: {labels_key({}): empty_value(metric)}
+            for name, metric in METRICS.items() if not metric.labels
+        }
+        try:
+            with self._directory_lock():
+                aggregate = self._fold_dead(os.listdir(self.directory))
+                merge_values(totals, aggregate['values'])
+                for name in os.listdir(self.directory):
+                    if process_id(name) is not None and name not in aggregate['folded']:
+                        merge_values(totals, read_json(os.path.join(self.directory, name)) or {})
+        except OSError as e:
+            logger.warning(f'Metrics are not read from {self.directory}: {e}')
+        return totals
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def number(value: float) -> str:
+    """ returns a value without rounding, whole values without a fraction """
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def sample(name: str, labels: Dict[str, str], value: float) -> str:
+    """ returns a line of the Prometheus text format """
+    text = ','.join(f'{label}="{escape(str(label_value))}"' for label, label_value in labels.items())
+    return f'{name}{{{text}}} {number(value)}' if text else f'{name} {number(value)}'
+
+
+def exposition(totals: Dict[str, Dict[str, Any]]) -> str:
+    """ returns metrics in the Prometheus text format """
+    lines: List[str] = []
+    for name, metric in METRICS.items():
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for key, value in sorted(totals.get(name, {}).items()):
+            labels = json.loads(key)
+            if metric.kind == 'counter':
+                lines.append(sample(name, labels, value))
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (math.inf,), value['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else f'{bound:g}'
+                lines.append(sample(f'{name}_bucket', {**labels, 'le': le}, cumulative))
+            lines.append(sample(f'{name}_sum', labels, value['sum']))
+            lines.append(sample(f'{name}_count', labels, value['count']))
+    return '\n'.join(lines) + '\n'
+
+
+store = MetricsStore()
+
+
+def inc(name: str, amount: float = 1, **labels: str) -> None:
+    """ increments a counter of this process """
+    store.inc(name, amount, **labels)
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    """ adds an observation to a histogram of this process """
+    store.observe(name, value, **labels)
+
+
+def save() -> None:
+    """ writes unsaved values of this process, it is called at exit """
+    store.save()
+
+
+atexit.register(save)
+
+
+def metrics_text() -> str:
+    """ returns metrics of all processes in the Prometheus text format """
+    return exposition(store.collect())
@@ -0,0 +1,157 @@
+"""
+Performance and metrics middleware of pit requests
+"""
+import json
+import logging
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+from django.template.backends.django import Template
+from django.urls import ResolverMatch
+from pit import metrics
+
+logger = logging.getLogger('pit.performance')
+slow_logger = logging.getLogger('pit.performance.slow')
+
+SLOWEST_QUERIES = 5  # statements in the log line of every request
+
+
+class RequestProfile:
+    """ SQL statements and template render time of a request """
+
+    def __init__(self):
+        self.queries: List[Tuple[float, str]] = []  # (seconds, sql)
+        self.template_time: float = 0.0  # seconds
+        self.rendering: int = 0  # depth of nested renders, only the outer one is timed
+
+    def __call__(self, execute: Callable, sql: str, params: Any, many: bool, context: Dict[str, Any]) -> Any:
+        """ times a statement, it is the execute wrapper of database connections """
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((perf_counter() - started, sql))
+
+    @property
+    def sql_time(self) -> float:
+        return sum(duration for duration, _ in self.queries)
+
+    def slowest(self, count: int = SLOWEST_QUERIES) -> List[Tuple[float, str]]:
+        return sorted(self.queries, key=lambda query: query[0], reverse=True)[:count]
+
+    def server_timing(self, duration: float) -> str:
+        """ returns the Server-Timing header, durations are milliseconds,
+        app is the time spent outside of SQL and templates (Python and spatial work)
+        """
+        app = max(duration - self.sql_time - self.template_time, 0.0)
+        return ', '.join([
+            f'sql;dur={self.sql_time * 1000:.1f};desc="{len(self.queries)} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'app;dur={app * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar('pit_request_profile', default=None)
+
+
+def timed_render(render: Callable) -> Callable:
+    """ adds render time of templates to the profile of the current request """
+    @wraps(render)
+    def wrapper(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return render(*args, **kwargs)
+        started = perf_counter()
+        profile.rendering += 1
+        try:
+            return render(*args, **kwargs)
+        finally:
+            profile.rendering -= 1
+            if not profile.rendering:
+                profile.template_time += perf_counter() - started
+    wrapper.pit_timed = True
+    return wrapper
+
+
+def instrument_templates() -> None:
+    """ times rendering of Django templates, it is done once and only when the middleware is enabled """
+    if not getattr(Template.render, 'pit_timed', False):
+        Template.render = timed_render(Template.render)
+
+
+def ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+class PerformanceMiddleware:
+    """ Records SQL statements and template render time of every request,
+    adds them to the Server-Timing header and logs them to pit.performance as a JSON line,
+    requests slower than PIT_SLOW_REQUEST_MS milliseconds get all their statements
+    logged to pit.performance.slow.
+    It is removed from the chain unless PIT_PERFORMANCE is set, so it costs nothing when disabled
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        if not getattr(settings, 'PIT_PERFORMANCE', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_request = getattr(settings, 'PIT_SLOW_REQUEST_MS', 500) / 1000  # seconds
+        instrument_templates()
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        started = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        duration = perf_counter() - started
+        response['Server-Timing'] = profile.server_timing(duration)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'ms': ms(duration),
+            'sql_count': len(profile.queries),
+            'sql_ms': ms(profile.sql_time),
+            'template_ms': ms(profile.template_time),
+            'slowest': [{'ms': ms(seconds), 'sql': sql} for seconds, sql in profile.slowest()],
+        }
+        logger.info(json.dumps(record, ensure_ascii=False))
+        if duration >= self.slow_request:
+            record['queries'] = [{'ms': ms(seconds), 'sql': sql} for seconds, sql in profile.queries]
+            slow_logger.warning(json.dumps(record, ensure_ascii=False))
+        return response
+
+
+def view_name(match: ResolverMatch) -> str:
+    """ returns the name of the class of a class based view or the name of the function """
+    return getattr(match.func, 'view_class', match.func).__name__
+
+
+class MetricsMiddleware:
+    """ Observes latency of requests by view in pit_request_duration_seconds,
+    requests which are not resolved to a view are not observed
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        started = perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            metrics.observe(metrics.REQUEST_DURATION, perf_counter() - started, view=view_name(match))
+        return response
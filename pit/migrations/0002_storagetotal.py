@@ -0,0 +1,62 @@
+# Generated by Django 3.2.2 on 2026-10-17 12:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_storage_totals(apps, schema_editor):
+    """ calculates running totals of existing storages """
+    Storage = apps.get_model('pit', 'Storage')
+    Trip = apps.get_model('pit', 'Trip')
+    OtherStorageIncom = apps.get_model('pit', 'OtherStorageIncom')
+    StorageTotal = apps.get_model('pit', 'StorageTotal')
+    totals = []
+    for storage in Storage.objects.all():
+        other = OtherStorageIncom.objects.filter(storage=storage).aggregate(
+            weight=Coalesce(Sum('mineral__weight'), 0),
+            sio2=Coalesce(Sum(F('mineral__weight') * F('mineral__sio2')), 0),
+            fe=Coalesce(Sum(F('mineral__weight') * F('mineral__fe')), 0),
+        )
+        trips = Trip.objects.filter(
+            unloading_point__isnull=False,
+            unloading_point__coveredby=storage.territory,
+        ).aggregate(
+            weight=Coalesce(Sum('mineral__weight'), 0),
+            sio2=Coalesce(Sum(F('mineral__weight') * F('mineral__sio2')), 0),
+            fe=Coalesce(Sum(F('mineral__weight') * F('mineral__fe')), 0),
+        )
+        totals.append(StorageTotal(
+            storage=storage,
+            other_weight=other['weight'],
+            other_sio2=other['sio2'],
+            other_fe=other['fe'],
+            trips_weight=trips['weight'],
+            trips_sio2=trips['sio2'],
+            trips_fe=trips['fe'],
+        ))
+    StorageTotal.objects.bulk_create(totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pit', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageTotal',
+            fields=[
+                ('storage', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='pit.storage')),
+                ('other_weight', models.BigIntegerField(default=0)),
+                ('other_sio2', models.BigIntegerField(default=0)),
+                ('other_fe', models.BigIntegerField(default=0)),
+                ('trips_weight', models.BigIntegerField(default=0)),
+                ('trips_sio2', models.BigIntegerField(default=0)),
+                ('trips_fe', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_storage_totals, migrations.RunPython.noop),
+    ]
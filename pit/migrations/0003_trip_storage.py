@@ -0,0 +1,31 @@
+# Generated by Django 3.2.2 on 2026-10-17 12:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_trip_storages(apps, schema_editor):
+    """ sets storages of finished trips by their unloading points """
+    Storage = apps.get_model('pit', 'Storage')
+    Trip = apps.get_model('pit', 'Trip')
+    for storage in Storage.objects.all():
+        Trip.objects.filter(
+            unloading_point__isnull=False,
+            unloading_point__coveredby=storage.territory,
+        ).update(storage=storage)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pit', '0002_storagetotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='storage',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='pit.storage'),
+        ),
+        migrations.RunPython(fill_trip_storages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.2 on 2026-10-17 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pit', '0003_trip_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='unloaded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
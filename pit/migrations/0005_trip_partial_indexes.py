@@ -0,0 +1,21 @@
+# Generated by Django 3.2.2 on 2026-10-17 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pit', '0004_trip_unloaded_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(condition=models.Q(('unloading_point__isnull', True)), fields=['id'], name='pit_trip_active_id'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(condition=models.Q(('storage__isnull', True), ('unloading_point__isnull', False)), fields=['unloaded_at'], name='pit_trip_failed_unloaded_at'),
+        ),
+    ]
@@ -1,12 +1,54 @@
-from typing import Optional, Collection
+from datetime import datetime
+from typing import Any, Optional, Collection
 from django.contrib.gis.db import models
-from django.db.models import Q, CASCADE, F
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import (
+    Q, CASCADE, SET_NULL, F, Sum, Case, When, Value, IntegerField, BooleanField, ExpressionWrapper,
+    Exists, OuterRef, Subquery,
+)
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
 from pit.db_constraints import IUniqueConstraint
+import pit.db_lookups  # noqa: F401 registers __lower_exact
+from pit.spatial import storage_index, territory_cache
+from pit.catalog import catalog
 import pit.patterns as patterns
 from django.contrib.gis.geos import Point
 
 
+def xy_point(value: str) -> Point:
+    """ returns a Point from X Y string """
+    match = patterns.XY.search(value)
+    if not match:
+        raise ValueError(f'"{value}" is not a valid X Y Point')
+    return Point(float(match.group('x')), float(match.group('y')))
+
+
+class TrackedModel(models.Model):
+    """ A model that remembers values of fields loaded from the database,
+    so that signal handlers can see what a save has changed.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs) -> None:
+        """ save the model and everything that depends on it in one transaction """
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+        }
+
+    class Meta:
+        abstract = True
+
+
 # Create your models here.
 class TruckModel(models.Model):
     """ A model of a truck """
@@ -21,7 +63,7 @@ class TruckModel(models.Model):
     def validate_unique(self, exclude=None):
         if TruckModel.objects\
                 .exclude(id=self.id)\
-                .filter(title__iexact=self.title).exists():
+                .filter(title__lower_exact=self.title).exists():
             raise ValidationError({
                 'title': ValidationError(
                     f'Must be unique ignore case. '
@@ -62,17 +104,19 @@ class Truck(models.Model):
     @property
     def max_weight(self) -> int:
         """ returns the max_weight of the model of the truck """
-        return self.truck_model.max_weight
+        cached = catalog.truck_model(self.truck_model_id)
+        return self.truck_model.max_weight if cached is None else cached.max_weight
 
     @property
     def model_title(self) -> str:
         """ return the title of the model of the truck """
-        return self.truck_model.title
+        cached = catalog.truck_model(self.truck_model_id)
+        return self.truck_model.title if cached is None else cached.title
 
     def validate_unique(self, exclude=None):
         if Truck.objects\
                 .exclude(id=self.id)\
-                .filter(number__iexact=self.number).exists():
+                .filter(number__lower_exact=self.number).exists():
             raise ValidationError({
                 'number': ValidationError(
                     f'Must be unique ignore case. '
@@ -93,7 +137,13 @@ class Truck(models.Model):
         ]
 
 
-class Mineral(models.Model):
+QUALITY_TOTALS = (
+    'other_weight', 'other_sio2', 'other_fe',
+    'trips_weight', 'trips_sio2', 'trips_fe',
+)
+
+
+class Mineral(TrackedModel):
     """ Payload of a truck and the store """
     weight = models.IntegerField(null=False, blank=False)
     sio2 = models.IntegerField(null=False, blank=False)
@@ -151,24 +201,77 @@ class Mineral(models.Model):
         ]
 
 
-class Storage(models.Model):
+def storage_total(model: Any, expression: Any) -> Coalesce:
+    """ returns the sum of the expression over rows of the model
+    belonging to the outer storage, 0 when there are none
+    """
+    rows = model.objects.filter(storage=OuterRef('pk')).order_by().values('storage')
+    return Coalesce(Subquery(rows.annotate(total=Sum(expression)).values('total')), 0)
+
+
+class StorageQuerySet(models.QuerySet):
+    """ QuerySet of storages """
+
+    def with_quality_totals(self) -> 'StorageQuerySet':
+        """ annotates storages with QUALITY_TOTALS (sio2 and fe are sums of weight * %).
+        Every sum is a subquery over not trip incoms or trips of the storage,
+        which finds them by the index of their storage foreign key,
+        so the totals can be filtered and ordered by like any annotation.
+        """
+        return self.annotate(
+            other_weight=storage_total(OtherStorageIncom, F('mineral__weight')),
+            other_sio2=storage_total(OtherStorageIncom, F('mineral__weight') * F('mineral__sio2')),
+            other_fe=storage_total(OtherStorageIncom, F('mineral__weight') * F('mineral__fe')),
+            trips_weight=storage_total(Trip, F('mineral__weight')),
+            trips_sio2=storage_total(Trip, F('mineral__weight') * F('mineral__sio2')),
+            trips_fe=storage_total(Trip, F('mineral__weight') * F('mineral__fe')),
+        )
+
+    def attach_trips(self) -> int:
+        """ makes storages of the queryset the destinations of not attached finished trips
+        unloaded on their territories with one query, returns the number of attached trips
+        """
+        covering = self.filter(territory__covers=OuterRef('unloading_point'))
+        return Trip.objects.filter(
+            Exists(covering),
+            storage__isnull=True,
+            unloading_point__isnull=False,
+        ).update(storage=Subquery(covering.values('id')[:1]))
+
+
+class Storage(TrackedModel):
     """ A storage of mineral """
     title = models.CharField(
         max_length=40, null=False, blank=False, unique=True
     )
     territory = models.PolygonField(null=False, blank=False)
 
+    objects = StorageQuerySet.as_manager()
+
     def __str__(self) -> str:
         return f'Storage {self.title} {self.territory}'
 
+    def attach_trips(self) -> None:
+        """ makes the storage the destination of finished trips unloaded on its territory """
+        Trip.objects.filter(storage=self).update(storage=None)
+        Trip.objects.filter(
+            storage__isnull=True,
+            unloading_point__isnull=False,
+            unloading_point__coveredby=self.territory,
+        ).update(storage=self)
+
     def validate_unique(self, exclude: Optional[Collection[str]] = None):
-        intersectors = Storage.objects\
-            .exclude(id=self.id)\
-            .filter(territory__intersects=self.territory)
-        if intersectors.exists():
+        if not self.territory:
+            return
+        # prepared territories of the spatial index, no geometries are sent to the database
+        intersectors = [
+            storage_id for storage_id in storage_index.intersecting(self.territory)
+            if storage_id != self.id
+        ]
+        if intersectors:
             raise ValidationError({
                 'territory': ValidationError(
-                    f'Intercests with {intersectors[0].territory}'
+                    f'Intercests with {territory_cache.get(intersectors[0]).geometry}'
                 )
             })
 
@@ -185,7 +288,7 @@ class Storage(models.Model):
         ]
 
 
-class OtherStorageIncom(models.Model):
+class OtherStorageIncom(TrackedModel):
     """ Not trip incoms to a storage """
     mineral = models.OneToOneField(to=Mineral, on_delete=CASCADE)
     storage = models.ForeignKey(to=Storage, on_delete=CASCADE)
@@ -194,11 +297,127 @@ class OtherStorageIncom(models.Model):
         return f'Storage incom: {self.mineral} {self.storage}'
 
 
-class Trip(models.Model):
+class StorageTotalQuerySet(models.QuerySet):
+    """ QuerySet of running totals of storages """
+
+    def add(self, storage_id: int, prefix: str, weight: int, sio2: int, fe: int) -> None:
+        """ adds amounts to the running totals of the storage,
+        prefix is 'trips' or 'other', sio2 and fe are sums of weight * %
+        """
+        self.filter(storage_id=storage_id).update(**{
+            f'{prefix}_weight': F(f'{prefix}_weight') + weight,
+            f'{prefix}_sio2': F(f'{prefix}_sio2') + sio2,
+            f'{prefix}_fe': F(f'{prefix}_fe') + fe,
+        })
+
+    def add_mineral(self, storage_id: int, prefix: str, mineral: Mineral, sign: int = 1) -> None:
+        """ adds (sign=1) or subtracts (sign=-1) the mineral to the running totals of the storage """
+        self.add(storage_id, prefix,
+                 weight=sign * mineral.weight,
+                 sio2=sign * mineral.weight * mineral.sio2,
+                 fe=sign * mineral.weight * mineral.fe)
+
+    def rebuild(self, storage_ids: Optional[Collection[int]] = None) -> None:
+        """ recalculates running totals of storages (all by default) from scratch """
+        storages = Storage.objects.all()
+        if storage_ids is not None:
+            storages = storages.filter(id__in=storage_ids)
+        totals = {
+            storage.id: StorageTotal(storage=storage, **{
+                name: getattr(storage, name) for name in QUALITY_TOTALS
+            })
+            for storage in storages.with_quality_totals()
+        }
+        self.filter(storage__in=list(totals)).delete()
+        self.bulk_create(totals.values())
+
+
+class StorageTotal(models.Model):
+    """ Running totals of incoms of a storage for the report page.
+    *_sio2 and *_fe are sums of weight * %, so the quality of
+    a storage is sio2 / weight and fe / weight.
+    """
+    storage = models.OneToOneField(to=Storage, on_delete=CASCADE, primary_key=True)
+    other_weight = models.BigIntegerField(default=0)
+    other_sio2 = models.BigIntegerField(default=0)
+    other_fe = models.BigIntegerField(default=0)
+    trips_weight = models.BigIntegerField(default=0)
+    trips_sio2 = models.BigIntegerField(default=0)
+    trips_fe = models.BigIntegerField(default=0)
+
+    objects = StorageTotalQuerySet.as_manager()
+
+    def __str__(self) -> str:
+        return (f'Storage total: {self.storage_id}'
+                f' other={self.other_weight}t. trips={self.trips_weight}t.')
+
+
+class TripQuerySet(models.QuerySet):
+    """ QuerySet of trips """
+
+    def active(self) -> 'TripQuerySet':
+        """ trips which are not unloaded yet """
+        return self.filter(unloading_point__isnull=True)
+
+    def dashboard(self) -> 'TripQuerySet':
+        """ annotates values shown on the index page,
+        so trips are rendered without a query per trip
+        """
+        max_weight = F('truck__truck_model__max_weight')
+        return self.annotate(
+            dashboard_truck_number=F('truck__number'),
+            dashboard_truck_model_title=F('truck__truck_model__title'),
+            dashboard_truck_max_weight=max_weight,
+            dashboard_mineral_weight=F('mineral__weight'),
+            dashboard_overload=Case(
+                When(
+                    mineral__weight__gt=max_weight,
+                    then=(F('mineral__weight') - max_weight) * 100 / max_weight,
+                ),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+        )
+
+    def with_failed(self) -> 'TripQuerySet':
+        """ annotates unload_failed, True for finished trips out of any storage.
+        Storages are resolved when trips are unloaded, so it is a test of
+        the storage foreign key rather than a spatial anti-join.
+        """
+        return self.annotate(
+            unload_failed=ExpressionWrapper(
+                Q(unloading_point__isnull=False, storage__isnull=True),
+                output_field=BooleanField(),
+            ),
+        )
+
+    def failed_unloads(self, since: Optional[datetime] = None,
+                       until: Optional[datetime] = None) -> 'TripQuerySet':
+        """ trips unloaded out of any storage in [since, until).
+        Trips finished before unloaded_at was added have no unloading time,
+        they are excluded when since or until is given
+        """
+        trips = self.filter(unloading_point__isnull=False, storage__isnull=True)
+        if since is not None:
+            trips = trips.filter(unloaded_at__gte=since)
+        if until is not None:
+            trips = trips.filter(unloaded_at__lt=until)
+        return trips
+
+
+class Trip(TrackedModel):
     """ A trip of a truck """
     truck = models.ForeignKey(to=Truck, on_delete=CASCADE)
     mineral = models.OneToOneField(to=Mineral, on_delete=CASCADE)
     unloading_point = models.PointField(null=True)
+    storage = models.ForeignKey(to=Storage, on_delete=SET_NULL, null=True, blank=True)
+    unloaded_at = models.DateTimeField(null=True, blank=True)
+
+    objects = TripQuerySet.as_manager()
+
+    def dashboard_value(self, name: str) -> Any:
+        """ returns the value annotated by TripQuerySet.dashboard() or None """
+        return self.__dict__.get(f'dashboard_{name}')
 
     @property
     def active(self) -> bool:
@@ -210,23 +429,50 @@ class Trip(models.Model):
     @property
     def failed(self) -> bool:
         """ Returns True if the trip unload_point is not in any storage """
-        return False if self.active else not(Storage.objects.filter(
-            territory__covers=self.unloading_point
-        ).exists())
+        annotated = self.__dict__.get('unload_failed')
+        if annotated is not None and not self.storage_is_stale:
+            return annotated
+        if self.active:
+            return False
+        if self.storage_is_stale:
+            self.resolve_storage()
+        return self.storage_id is None
+
+    @property
+    def storage_is_stale(self) -> bool:
+        """ Returns True if the storage was not resolved for the current unloading_point """
+        resolved_point = getattr(
+            self, '_storage_point',
+            getattr(self, '_loaded_values', {}).get('unloading_point'),
+        )
+        return self.unloading_point != resolved_point
+
+    def resolve_storage(self) -> None:
+        """ sets the storage which covers the unloading_point """
+        self.storage_id = storage_index.locate(self.unloading_point)
+        self._storage_point = self.unloading_point
 
     @property
     def truck_max_weight(self) -> int:
         """ Returns max_weight of the model of the truck """
-        return self.truck.max_weight
+        annotated = self.dashboard_value('truck_max_weight')
+        if annotated is not None:
+            return annotated
+        cached = catalog.truck_model_of(self.truck_id)
+        return self.truck.max_weight if cached is None else cached.max_weight
 
     @property
     def mineral_weight(self) -> int:
         """ Returns weight of mineral payload """
-        return self.mineral.weight
+        annotated = self.dashboard_value('mineral_weight')
+        return self.mineral.weight if annotated is None else annotated
 
     @property
     def overload(self) -> float:
         """ Returns % of truck.max_weight overloading """
+        annotated = self.dashboard_value('overload')
+        if annotated is not None:
+            return annotated
         max_weight = self.truck_max_weight
         weight = self.mineral_weight
         if weight > max_weight:
@@ -236,12 +482,20 @@ class Trip(models.Model):
     @property
     def truck_number(self) -> str:
         """ Returns the number of the truck """
-        return self.truck.number
+        annotated = self.dashboard_value('truck_number')
+        if annotated is not None:
+            return annotated
+        cached = catalog.truck(self.truck_id)
+        return self.truck.number if cached is None else cached.number
 
     @property
     def truck_model_title(self) -> str:
         """ Returns the title of the model of the truck """
-        return self.truck.model_title
+        annotated = self.dashboard_value('truck_model_title')
+        if annotated is not None:
+            return annotated
+        cached = catalog.truck_model_of(self.truck_id)
+        return self.truck.model_title if cached is None else cached.title
 
     @property
     def xy(self) -> Optional[str]:
@@ -253,11 +507,29 @@ class Trip(models.Model):
     @xy.setter
     def xy(self, value: str) -> None:
         """ setter for unloading_point from X Y string """
-        match = patterns.XY.search(value)
-        if match:
-            self.unloading_point = Point(int(match.group('x')), int(match.group('y')))
-        else:
-            raise ValueError(f'"{value}" is not a valid X Y Point')
+        self.unloading_point = xy_point(value)
+        self.resolve_storage()
+
+    @property
+    def unloading_point_was_null(self) -> bool:
+        """ Returns True then the trip is new or was loaded without an unloading point """
+        if self._state.adding:
+            return True
+        loaded = getattr(self, '_loaded_values', {})
+        return 'unloading_point' in loaded and loaded['unloading_point'] is None
+
+    def save(self, *args, **kwargs) -> None:
+        """ save the trip with the storage and the time of its unloading,
+        the time is set when the unloading point changes from NULL only,
+        so saving a trip finished without a time does not invent one
+        """
+        if self.storage_is_stale:
+            self.resolve_storage()
+        if not self.unloading_point:
+            self.unloaded_at = None
+        elif self.unloaded_at is None and self.unloading_point_was_null:
+            self.unloaded_at = timezone.now()
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return (f'{"Active t" if self.active else "T" }rip'
@@ -272,3 +544,18 @@ class Trip(models.Model):
                 condition=Q(unloading_point__isnull=True)
             )
         ]
+        # GiST indexes of unloading_point and Storage.territory are created by spatial_index=True
+        indexes = [
+            # keyset pagination of active trips on the index page
+            models.Index(
+                name='%(app_label)s_%(class)s_active_id',
+                fields=['id'],
+                condition=Q(unloading_point__isnull=True),
+            ),
+            # failed unloads by time
+            models.Index(
+                name='%(app_label)s_%(class)s_failed_unloaded_at',
+                fields=['unloaded_at'],
+                condition=Q(unloading_point__isnull=False, storage__isnull=True),
+            ),
+        ]
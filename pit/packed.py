@@ -0,0 +1,89 @@
+"""
+Binary packed batches of unload events of the telemetry gateway.
+
+A batch is a header followed by fixed width little-endian records:
+    header: magic b'PIT1', version (uint8), flags (uint8), count of records (uint32)
+    record: truck id (uint32), x (float64), y (float64), unix timestamp (float64, 0 - time of receiving)
+    record with FLAG_WKB: truck id (uint32), unix timestamp (float64), 2D WKB point (21 bytes, NDR)
+"""
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+import math
+import struct
+from django.contrib.gis.geos import Point
+from pit.ingest import TruckUnload
+
+MAGIC = b'PIT1'
+VERSION = 1
+FLAG_WKB = 0x01
+HEADER = struct.Struct('<4sBBI')
+RECORD = struct.Struct('<Iddd')
+WKB_RECORD = struct.Struct('<IdBIdd')  # WKB point: byte order 1 (NDR), geometry type 1 (Point), x, y
+WKB_NDR = 1
+WKB_POINT = 1
+MAX_TIMESTAMP = datetime(9999, 12, 31, tzinfo=timezone.utc).timestamp()  # the last day of datetime
+
+Record = Tuple[int, float, float, Optional[float]]  # truck id, x, y, unix timestamp
+
+
+class BatchTooLarge(ValueError):
+    """ The header of a batch counts more records than are accepted """
+
+
+def encode(records: Iterable[Record], wkb: bool = False) -> bytes:
+    """ packs records into a batch """
+    if wkb:
+        body = [WKB_RECORD.pack(truck_id, timestamp or 0.0, WKB_NDR, WKB_POINT, x, y)
+                for truck_id, x, y, timestamp in records]
+    else:
+        body = [RECORD.pack(truck_id, x, y, timestamp or 0.0)
+                for truck_id, x, y, timestamp in records]
+    return HEADER.pack(MAGIC, VERSION, FLAG_WKB if wkb else 0, len(body)) + b''.join(body)
+
+
+def checked_record(index: int, truck_id: int, x: float, y: float, timestamp: float) -> Record:
+    """ returns a record with a timestamp of 0 as None, raises ValueError for
+    coordinates which are not finite and timestamps out of range of datetime
+    """
+    if not (math.isfinite(x) and math.isfinite(y)):
+        raise ValueError(f'Record {index}: coordinates must be finite numbers')
+    if not 0 <= timestamp <= MAX_TIMESTAMP:  # false for NaN as well
+        raise ValueError(f'Record {index}: timestamp {timestamp} is out of range')
+    return truck_id, x, y, timestamp or None
+
+
+def decode_records(data: bytes, max_count: Optional[int] = None) -> List[Record]:
+    """ unpacks records of a batch, raises ValueError for malformed batches
+    and BatchTooLarge, before unpacking, if the header counts more than max_count records
+    """
+    view = memoryview(data)
+    if len(view) < HEADER.size:
+        raise ValueError('The batch is shorter than the header')
+    magic, version, flags, count = HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'Unsupported batch {bytes(magic)!r} version {version}')
+    if max_count is not None and count > max_count:
+        raise BatchTooLarge(f'At most {max_count} events per batch')
+    record = WKB_RECORD if flags & FLAG_WKB else RECORD
+    body = view[HEADER.size:]
+    if len(body) != count * record.size:
+        raise ValueError(f'Expected {count} records of {record.size} bytes, got {len(body)} bytes')
+    if record is RECORD:
+        return [
+            checked_record(index, truck_id, x, y, timestamp)
+            for index, (truck_id, x, y, timestamp) in enumerate(RECORD.iter_unpack(body))
+        ]
+    records = []
+    for index, (truck_id, timestamp, byte_order, geometry_type, x, y) in enumerate(WKB_RECORD.iter_unpack(body)):
+        if byte_order != WKB_NDR or geometry_type != WKB_POINT:
+            raise ValueError('Only little-endian 2D WKB points are supported')
+        records.append(checked_record(index, truck_id, x, y, timestamp))
+    return records
+
+
+def decode(data: bytes, max_count: Optional[int] = None) -> List[TruckUnload]:
+    """ returns unloads by truck ids of a batch """
+    return [
+        (truck_id, Point(x, y), datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else None)
+        for truck_id, x, y, timestamp in decode_records(data, max_count)
+    ]
@@ -0,0 +1,133 @@
+"""
+Storage report of the report page
+"""
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from pit import metrics
+from pit.models import Trip, Storage, StorageTotal
+from pit.versions import REPORT, get_version
+
+Totals = Tuple[int, int, int, int, int, int]  # weight, sio2, fe of other incoms, then of trips
+
+
+def quality(weight: int, sio2: int, fe: int) -> str:
+    """ returns the quality of a mineral mass from sums of weight * % """
+    percent_sio2 = sio2 // weight if weight else 0
+    percent_fe = fe // weight if weight else 0
+    return f'{percent_sio2}% SiO2, {percent_fe}% Fe'
+
+
+def storage_report() -> List[Dict[str, Any]]:
+    """ returns rows of the report page using running totals of storages """
+    report = []
+    for storage in Storage.objects.select_related('storagetotal').order_by('id'):
+        total = getattr(storage, 'storagetotal', None) or StorageTotal(storage=storage)
+        weight = total.other_weight + total.trips_weight
+        report.append({
+            'title': storage.title,
+            'weight_before': total.other_weight,
+            'sum_weight_after': weight,
+            'quality_after': quality(
+                weight,
+                total.other_sio2 + total.trips_sio2,
+                total.other_fe + total.trips_fe,
+            ),
+        })
+    return report
+
+
+REPORT_CACHE_TIMEOUT = getattr(settings, 'PIT_REPORT_CACHE_TIMEOUT', 300)  # seconds
+REPORT_LOCK_TIMEOUT = 30  # seconds, a dead calculation does not block others longer
+REPORT_POLL_INTERVAL = 0.05  # seconds
+_report_lock = threading.Lock()
+
+
+def cached_storage_report() -> List[Dict[str, Any]]:
+    """ returns the storage report cached for the current version of pit data.
+    A missing report is calculated once: in a process concurrent requests wait
+    for the lock, other processes wait while the calculation key added with
+    cache.add() exists (atomic for local memory and database backends,
+    best effort for the file based one).
+    Inside a transaction the data may be uncommitted, so the cache is not used.
+    """
+    if connection.in_atomic_block:
+        return storage_report()
+    key = f'pit:report:{get_version(REPORT)}'
+    report = cache.get(key)
+    if report is not None:
+        return report
+    with _report_lock:
+        deadline = time.monotonic() + REPORT_LOCK_TIMEOUT
+        while True:
+            report = cache.get(key)
+            if report is not None:
+                return report
+            if cache.add(f'{key}:lock', True, timeout=REPORT_LOCK_TIMEOUT) or time.monotonic() > deadline:
+                break
+            time.sleep(REPORT_POLL_INTERVAL)
+        try:
+            started = time.perf_counter()
+            report = storage_report()
+            metrics.observe(metrics.REPORT_RECOMPUTE, time.perf_counter() - started)
+            cache.set(key, report, timeout=REPORT_CACHE_TIMEOUT)
+        finally:
+            cache.delete(f'{key}:lock')
+        return report
+
+
+def legacy_storage_totals() -> Dict[int, Totals]:
+    """ calculates totals of storages with spatial subqueries over all trips,
+    it is the reference result for running totals of storages
+    """
+    def trips_sum(expression: Any) -> Subquery:
+        return Subquery(
+            Trip.objects.filter(
+                unloading_point__isnull=False,  # exclude active trips
+                unloading_point__intersects=OuterRef('territory')  # filter by intersection with the storage polygon
+            ).annotate(
+                storage=OuterRef('pk')  # add storage id field (for GROUP BY)
+            ).values(
+                'storage'  # GROUP BY storage id
+            ).annotate(
+                total=Sum(expression),
+            ).values('total')
+        )
+
+    storages = Storage.objects.annotate(
+        weight_before=Coalesce(Sum('otherstorageincom__mineral__weight'), 0),
+        sio2_before=Coalesce(Sum(F('otherstorageincom__mineral__weight') * F('otherstorageincom__mineral__sio2')), 0),
+        fe_before=Coalesce(Sum(F('otherstorageincom__mineral__weight') * F('otherstorageincom__mineral__fe')), 0),
+        weight_after=Coalesce(trips_sum(F('mineral__weight')), 0),
+        sio2_after=Coalesce(trips_sum(F('mineral__weight') * F('mineral__sio2')), 0),
+        fe_after=Coalesce(trips_sum(F('mineral__weight') * F('mineral__fe')), 0),
+    ).values_list('id', 'weight_before', 'sio2_before', 'fe_before',
+                  'weight_after', 'sio2_after', 'fe_after')
+    return {row[0]: row[1:] for row in storages}
+
+
+def storage_totals_mismatches() -> List[str]:
+    """ compares running totals of storages with the reference result,
+    returns descriptions of differences
+    """
+    expected = legacy_storage_totals()
+    actual: Dict[int, Totals] = {
+        total.storage_id: (
+            total.other_weight, total.other_sio2, total.other_fe,
+            total.trips_weight, total.trips_sio2, total.trips_fe,
+        )
+        for total in StorageTotal.objects.all()
+    }
+    mismatches = []
+    for storage_id in sorted(set(expected) | set(actual)):
+        if expected.get(storage_id) != actual.get(storage_id):
+            mismatches.append(
+                f'Storage {storage_id}: expected {expected.get(storage_id)},'
+                f' got {actual.get(storage_id)}'
+            )
+    return mismatches
@@ -0,0 +1,133 @@
+"""
+Signal handlers that keep derived data in sync with the pit models
+"""
+from typing import Any
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from pit.models import (
+    TruckModel,
+    Truck,
+    Mineral,
+    Storage,
+    OtherStorageIncom,
+    Trip,
+    StorageTotal,
+)
+from pit.spatial import storage_index
+from pit.catalog import catalog
+from pit.versions import REPORT, mark_changed
+
+
+def loaded(instance: Any, attname: str) -> Any:
+    """ returns the value of the field loaded from the database """
+    return getattr(instance, '_loaded_values', {}).get(attname)
+
+
+@receiver(post_save, sender=TruckModel)
+@receiver(post_delete, sender=TruckModel)
+@receiver(post_save, sender=Truck)
+@receiver(post_delete, sender=Truck)
+def catalog_changed(sender, **kwargs) -> None:
+    """ any write of truck models or trucks outdates the catalog """
+    catalog.invalidate()
+
+
+@receiver(post_save, sender=Storage)
+def storage_saved(sender, instance: Storage, created: bool, raw: bool, **kwargs) -> None:
+    """ a new or moved storage gets its trips and totals recalculated,
+    titles are not in the spatial index, so renames do not invalidate it
+    """
+    if raw:
+        return
+    if created or loaded(instance, 'territory') != instance.territory:
+        storage_index.invalidate()
+        instance.attach_trips()
+        StorageTotal.objects.rebuild(storage_ids=[instance.id])
+
+
+@receiver(post_delete, sender=Storage)
+def storage_deleted(sender, instance: Storage, **kwargs) -> None:
+    """ a deleted storage is removed from spatial index """
+    storage_index.invalidate()
+
+
+@receiver(post_save, sender=Trip)
+def trip_saved(sender, instance: Trip, created: bool, raw: bool, **kwargs) -> None:
+    """ moves the mineral of the trip between storage totals on unloading """
+    if raw:
+        return
+    old_storage_id = loaded(instance, 'storage_id')
+    old_mineral_id = loaded(instance, 'mineral_id')
+    if old_storage_id == instance.storage_id and old_mineral_id == instance.mineral_id:
+        return
+    if old_storage_id:
+        StorageTotal.objects.add_mineral(
+            old_storage_id, 'trips', Mineral.objects.get(id=old_mineral_id), sign=-1
+        )
+    if instance.storage_id:
+        StorageTotal.objects.add_mineral(instance.storage_id, 'trips', instance.mineral)
+
+
+@receiver(post_delete, sender=Trip)
+def trip_deleted(sender, instance: Trip, **kwargs) -> None:
+    """ removes the mineral of a finished trip from storage totals """
+    if instance.storage_id:
+        StorageTotal.objects.add_mineral(instance.storage_id, 'trips', instance.mineral, sign=-1)
+
+
+@receiver(post_save, sender=OtherStorageIncom)
+def other_storage_incom_saved(sender, instance: OtherStorageIncom, created: bool,
+                              raw: bool, **kwargs) -> None:
+    """ adds a not trip incom to storage totals """
+    if raw:
+        return
+    old_storage_id = loaded(instance, 'storage_id')
+    old_mineral_id = loaded(instance, 'mineral_id')
+    if old_storage_id == instance.storage_id and old_mineral_id == instance.mineral_id:
+        return
+    if old_storage_id:
+        StorageTotal.objects.add_mineral(
+            old_storage_id, 'other', Mineral.objects.get(id=old_mineral_id), sign=-1
+        )
+    StorageTotal.objects.add_mineral(instance.storage_id, 'other', instance.mineral)
+
+
+@receiver(post_delete, sender=OtherStorageIncom)
+def other_storage_incom_deleted(sender, instance: OtherStorageIncom, **kwargs) -> None:
+    """ removes a not trip incom from storage totals """
+    StorageTotal.objects.add_mineral(instance.storage_id, 'other', instance.mineral, sign=-1)
+
+
+@receiver(post_save, sender=Mineral)
+def mineral_saved(sender, instance: Mineral, created: bool, raw: bool, **kwargs) -> None:
+    """ applies changes of weight or quality of an already stored mineral """
+    if raw or created:
+        return
+    old = Mineral(
+        weight=loaded(instance, 'weight'),
+        sio2=loaded(instance, 'sio2'),
+        fe=loaded(instance, 'fe'),
+    )
+    if old.weight is None:
+        return
+    if (old.weight, old.sio2, old.fe) == (instance.weight, instance.sio2, instance.fe):
+        return
+    incom = OtherStorageIncom.objects.filter(mineral=instance).first()
+    if incom:
+        storage_id, prefix = incom.storage_id, 'other'
+    else:
+        trip = Trip.objects.filter(mineral=instance).first()
+        storage_id, prefix = trip.storage_id if trip else None, 'trips'
+    if storage_id:
+        StorageTotal.objects.add_mineral(storage_id, prefix, old, sign=-1)
+        StorageTotal.objects.add_mineral(storage_id, prefix, instance)
+
+
+def report_data_changed(sender, **kwargs) -> None:
+    """ any write of data of the report outdates the cached report """
+    mark_changed(REPORT)
+
+
+for model in (Mineral, Storage, OtherStorageIncom, Trip):
+    post_save.connect(report_data_changed, sender=model, dispatch_uid=f'pit_report_{model.__name__}_saved')
+    post_delete.connect(report_data_changed, sender=model, dispatch_uid=f'pit_report_{model.__name__}_deleted')
@@ -0,0 +1,127 @@
+"""
+Named snapshots of pit tables stored as copies in schemas of the database
+"""
+import json
+import re
+from typing import Any, Dict, List
+from django.db import connection, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import AutoField
+from django.utils import timezone
+from pit.models import (
+    TruckModel,
+    Truck,
+    Mineral,
+    Storage,
+    OtherStorageIncom,
+    Trip,
+    StorageTotal,
+)
+from pit.catalog import catalog
+from pit.spatial import storage_index
+from pit.utils import truncate
+from pit.versions import REPORT, mark_changed
+
+SCHEMA_PREFIX = 'pit_snapshot_'
+NAME = re.compile(r'^[a-z0-9_]{1,40}$')
+SNAPSHOT_MODELS = (TruckModel, Truck, Mineral, Storage, Trip, OtherStorageIncom, StorageTotal)  # in order of FKs
+
+
+class SnapshotError(Exception):
+    """ A snapshot can not be created or restored """
+
+
+def schema_name(name: str) -> str:
+    """ returns the quoted schema of the snapshot """
+    if not NAME.match(name):
+        raise SnapshotError(f'Invalid snapshot name "{name}", use up to 40 of a-z, 0-9 and _')
+    return connection.ops.quote_name(f'{SCHEMA_PREFIX}{name}')
+
+
+def columns(model: Any) -> str:
+    return ', '.join(connection.ops.quote_name(field.column) for field in model._meta.concrete_fields)
+
+
+def pit_migration() -> str:
+    """ returns the last applied migration of pit, snapshots are restored only to the same schema """
+    return MigrationRecorder.Migration.objects.filter(app='pit').order_by('-name').values_list(
+        'name', flat=True
+    ).first() or ''
+
+
+def list_snapshots() -> List[Dict[str, Any]]:
+    """ returns names, creation times, migrations and numbers of rows of snapshots """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nspname, obj_description(oid, 'pg_namespace') FROM pg_namespace"
+            " WHERE nspname LIKE %s ORDER BY nspname",
+            [SCHEMA_PREFIX.replace('_', '\\_') + '%'],
+        )
+        rows = cursor.fetchall()
+    return [
+        {'name': schema[len(SCHEMA_PREFIX):], **json.loads(comment or '{}')}
+        for schema, comment in rows
+    ]
+
+
+def snapshot_exists(name: str) -> bool:
+    return any(snapshot['name'] == name for snapshot in list_snapshots())
+
+
+@transaction.atomic
+def create_snapshot(name: str, replace: bool = False) -> Dict[str, Any]:
+    """ copies pit tables into the schema of the snapshot """
+    schema = schema_name(name)
+    if snapshot_exists(name):
+        if not replace:
+            raise SnapshotError(f'Snapshot "{name}" exists')
+        delete_snapshot(name)
+    info: Dict[str, Any] = {
+        'created_at': timezone.now().isoformat(),
+        'migration': pit_migration(),
+        'rows': {},
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA {schema}')
+        for model in SNAPSHOT_MODELS:
+            table = connection.ops.quote_name(model._meta.db_table)
+            cursor.execute(f'CREATE TABLE {schema}.{table} AS SELECT {columns(model)} FROM {table}')
+            info['rows'][model._meta.model_name] = cursor.rowcount
+        cursor.execute(f'COMMENT ON SCHEMA {schema} IS %s', [json.dumps(info)])
+    return {'name': name, **info}
+
+
+@transaction.atomic
+def restore_snapshot(name: str) -> None:
+    """ replaces pit tables with copies of the snapshot in one transaction """
+    schema = schema_name(name)
+    snapshot = next((snapshot for snapshot in list_snapshots() if snapshot['name'] == name), None)
+    if snapshot is None:
+        raise SnapshotError(f'Snapshot "{name}" does not exist')
+    if snapshot.get('migration') != pit_migration():
+        raise SnapshotError(
+            f'Snapshot "{name}" was created at migration {snapshot.get("migration")},'
+            f' the database is at {pit_migration()}'
+        )
+    truncate()
+    with connection.cursor() as cursor:
+        for model in SNAPSHOT_MODELS:
+            table = connection.ops.quote_name(model._meta.db_table)
+            cursor.execute(f'INSERT INTO {table} ({columns(model)}) SELECT {columns(model)} FROM {schema}.{table}')
+            if isinstance(model._meta.pk, AutoField):
+                pk = connection.ops.quote_name(model._meta.pk.column)
+                cursor.execute(
+                    f'SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(MAX({pk}), 1), MAX({pk}) IS NOT NULL)'
+                    f' FROM {table}',
+                    [model._meta.db_table, model._meta.pk.column],
+                )
+    # rows are copied without signals, so everything derived from them is outdated
+    storage_index.invalidate()
+    catalog.invalidate()
+    mark_changed(REPORT)
+
+
+def delete_snapshot(name: str) -> None:
+    """ drops the schema of the snapshot """
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {schema_name(name)} CASCADE')
@@ -0,0 +1,216 @@
+"""
+In-process spatial index of storage territories
+"""
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import CharField, Func
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.contrib.gis.geos.prepared import PreparedGeometry
+from pit.versions import STORAGES, get_version, mark_changed
+
+CHECK_INTERVAL = getattr(settings, 'PIT_STORAGES_CHECK_INTERVAL', 1.0)  # seconds between checks of the version
+
+Envelope = Tuple[float, float, float, float]  # xmin, ymin, xmax, ymax
+Entry = Tuple[float, float, float, float, Any]  # envelope and a value or child entries
+
+
+class STRtree:
+    """ R-tree of envelopes packed with the Sort-Tile-Recursive algorithm """
+
+    def __init__(self, items: Iterable[Tuple[Envelope, Any]], node_capacity: int = 10) -> None:
+        level: List[Entry] = [(*envelope, value) for envelope, value in items]
+        self.height = 0
+        while len(level) > node_capacity:
+            level = self._pack(level, node_capacity)
+            self.height += 1
+        self.root = level
+
+    @staticmethod
+    def _pack(entries: List[Entry], node_capacity: int) -> List[Entry]:
+        """ groups entries into nodes of the next level """
+        slice_count = math.ceil(math.sqrt(math.ceil(len(entries) / node_capacity)))
+        slice_size = slice_count * node_capacity
+        entries = sorted(entries, key=lambda e: e[0] + e[2])
+        nodes: List[Entry] = []
+        for i in range(0, len(entries), slice_size):
+            tile = sorted(entries[i:i + slice_size], key=lambda e: e[1] + e[3])
+            for j in range(0, len(tile), node_capacity):
+                children = tile[j:j + node_capacity]
+                nodes.append((
+                    min(e[0] for e in children),
+                    min(e[1] for e in children),
+                    max(e[2] for e in children),
+                    max(e[3] for e in children),
+                    children,
+                ))
+        return nodes
+
+    def query(self, xmin: float, ymin: float, xmax: float, ymax: float) -> Iterator[Any]:
+        """ yields values whose envelopes intersect the envelope """
+        stack = [(self.root, self.height)]
+        while stack:
+            entries, height = stack.pop()
+            for entry in entries:
+                if entry[0] <= xmax and entry[2] >= xmin and entry[1] <= ymax and entry[3] >= ymin:
+                    if height:
+                        stack.append((entry[4], height - 1))
+                    else:
+                        yield entry[4]
+
+
+class Territory(NamedTuple):
+    geometry: GEOSGeometry
+    prepared: PreparedGeometry
+
+
+class TerritoryCache:
+    """ Parsed and prepared territories of storages keyed on the storage id
+    and the MD5 of the territory calculated by the database,
+    so only new and changed territories are fetched and parsed
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._territories: Dict[Tuple[int, str], Territory] = {}
+        self._by_id: Dict[int, Territory] = {}
+
+    def load(self) -> Dict[int, Territory]:
+        """ returns territories of all storages by their ids,
+        the same mapping is returned while no territory is added, changed or removed
+        """
+        from pit.models import Storage
+        storages = Storage.objects.annotate(
+            territory_hash=Func(Func('territory', function='ST_AsEWKB'), function='MD5', output_field=CharField()),
+        )
+        with self._lock:
+            keys = dict(storages.values_list('id', 'territory_hash'))
+            missing = [storage_id for storage_id, key in keys.items() if (storage_id, key) not in self._territories]
+            territories = {
+                key: territory
+                for key, territory in self._territories.items() if keys.get(key[0]) == key[1]
+            }
+            if not missing and len(territories) == len(self._territories):
+                return self._by_id
+            for storage_id, key, territory in storages.filter(id__in=missing).values_list(
+                    'id', 'territory_hash', 'territory'):
+                territories[(storage_id, key)] = Territory(territory, territory.prepared)
+            self._territories = territories
+            self._by_id = {storage_id: territory for (storage_id, _), territory in territories.items()}
+            return self._by_id
+
+    def get(self, storage_id: int) -> Optional[Territory]:
+        """ returns the territory of the storage as of the last load """
+        return self._by_id.get(storage_id)
+
+
+territory_cache = TerritoryCache()
+
+
+def pending_in_transaction(marker: Optional[Callable[[], None]]) -> bool:
+    """ returns True while the on_commit callback is pending in the transaction of this thread,
+    Django drops callbacks on rollback (to a savepoint as well) and runs them on commit
+    """
+    return marker is not None and connection.in_atomic_block and any(
+        entry[1] is marker for entry in reversed(connection.run_on_commit)
+    )
+
+
+class StorageIndex:
+    """ Process-local index of prepared storage territories.
+    It is rebuilt lazily when the storages version changes, the version
+    is checked at most every CHECK_INTERVAL seconds.
+    A transaction which changed storages gets a tree of its own, built once
+    per change and used by the thread of the transaction until commit or rollback.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._checked = 0.0
+        self._tree = STRtree([])
+        self._local = threading.local()  # markers of changes and the tree of the transaction of a thread
+        self._built: Tuple[Dict[int, Territory], STRtree] = ({}, self._tree)  # the last tree and its territories
+
+    def _pending(self) -> Tuple[List[Callable[[], None]], Optional[Tuple[Callable[[], None], STRtree]]]:
+        """ returns markers of changes of the transaction of this thread and its tree with the marker it is built for """
+        if not hasattr(self._local, 'markers'):
+            self._local.markers = []
+            self._local.tree = None
+        return self._local.markers, self._local.tree
+
+    def invalidate(self) -> None:
+        """ marks storages as changed in this transaction now and in all processes after commit """
+        mark_changed(STORAGES)
+        self._checked = 0.0  # the version is checked by the next lookup outside of the transaction
+        if connection.in_atomic_block:
+            def marker() -> None:
+                """ marks the transaction with changed storages, after commit the version is checked at once """
+                self._checked = 0.0
+            transaction.on_commit(marker)
+            self._pending()[0].append(marker)
+
+    def _build(self) -> STRtree:
+        """ returns a tree of territories, it is reused while territories are not changed """
+        territories = territory_cache.load()
+        if territories is not self._built[0]:
+            self._built = territories, STRtree(
+                (territory.geometry.extent, (storage_id, territory.prepared))
+                for storage_id, territory in territories.items()
+            )
+        return self._built[1]
+
+    def _current(self) -> STRtree:
+        """ returns the tree for the current storages """
+        markers, tree = self._pending()
+        while markers and not pending_in_transaction(markers[-1]):
+            markers.pop()  # committed or rolled back
+        if markers:
+            # changes of this transaction are not visible to others until commit,
+            # the tree is built after the last change which is not rolled back
+            if tree is None or tree[0] is not markers[-1]:
+                tree = self._local.tree = (markers[-1], self._build())
+            return tree[1]
+        self._local.tree = None
+        now = time.monotonic()
+        if self._version is None or now - self._checked >= CHECK_INTERVAL:
+            version = get_version(STORAGES)
+            if version != self._version:
+                self._tree = self._build()
+                self._version = version
+            self._checked = now
+        return self._tree
+
+    def locate(self, point: Optional[Point]) -> Optional[int]:
+        """ returns id of the storage which covers the point """
+        return self.locate_many([point])[0]
+
+    def locate_many(self, points: Sequence[Optional[Point]]) -> List[Optional[int]]:
+        """ returns ids of storages which cover the points """
+        with self._lock:
+            tree = self._current()
+            result: List[Optional[int]] = []
+            for point in points:
+                storage_id = None
+                if point:
+                    for candidate_id, territory in tree.query(point.x, point.y, point.x, point.y):
+                        if territory.covers(point):
+                            storage_id = candidate_id
+                            break
+                result.append(storage_id)
+            return result
+
+    def intersecting(self, geometry: GEOSGeometry) -> List[int]:
+        """ returns ids of storages which intersect the geometry """
+        with self._lock:
+            return [
+                storage_id
+                for storage_id, territory in self._current().query(*geometry.extent)
+                if territory.intersects(geometry)
+            ]
+
+
+storage_index = StorageIndex()
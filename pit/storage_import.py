@@ -0,0 +1,151 @@
+"""
+Bulk import of storage territories from GeoJSON or WKB
+"""
+import csv
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from django.contrib.gis.geos import GEOSException, GEOSGeometry
+from django.db import transaction
+from django.db.models.functions import Lower
+from pit.models import Storage, StorageTotal
+from pit.spatial import STRtree, storage_index
+from pit.versions import REPORT, mark_changed
+
+FORMATS = {
+    'geojson': 'a FeatureCollection, loaded at once',
+    'geojsonseq': 'a Feature per line (RFC 8142 record separators are allowed), streamed',
+    'wkb': 'CSV rows of title and hex WKB (or WKT), streamed',
+}
+EXTENSIONS = {'.geojson': 'geojson', '.json': 'geojson', '.geojsons': 'geojsonseq',
+              '.geojsonl': 'geojsonseq', '.ndjson': 'geojsonseq', '.csv': 'wkb'}
+SRID = 4326
+
+Source = Tuple[str, Any, Any]  # position in the file, title, geometry in the format of the file
+Conflict = Tuple[str, str, str]  # position in the file, title, description
+
+
+class UnreadableRecord(ValueError):
+    """ The geometry of a source of a record which could not be read, it is reported as a conflict """
+
+
+def file_format(path: str) -> Optional[str]:
+    """ guesses the format of a file by its extension """
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def feature_source(position: str, feature: Any) -> Source:
+    """ returns the title and GeoJSON geometry of a feature """
+    if not isinstance(feature, dict):
+        return position, None, None
+    geometry = feature.get('geometry')
+    return position, (feature.get('properties') or {}).get('title'), geometry and json.dumps(geometry)
+
+
+def read_sources(lines: Iterable[str], fmt: str) -> Iterator[Source]:
+    """ yields titles and geometries of storages of a file """
+    if fmt == 'geojson':
+        collection = json.loads(''.join(lines))
+        for i, feature in enumerate(collection.get('features', []), start=1):
+            yield feature_source(f'feature {i}', feature)
+    elif fmt == 'geojsonseq':
+        for i, line in enumerate(lines, start=1):
+            line = line.strip('\x1e \t\r\n')
+            if not line:
+                continue
+            try:
+                feature = json.loads(line)
+            except ValueError as e:
+                yield f'line {i}', None, UnreadableRecord(f'Invalid JSON: {e}')
+            else:
+                yield feature_source(f'line {i}', feature)
+    elif fmt == 'wkb':
+        reader = csv.reader(lines)
+        for row in reader:
+            if row and row[0].strip().lower() != 'title':
+                yield f'line {reader.line_num}', row[0], row[1] if len(row) > 1 else None
+    else:
+        raise ValueError(f'Unknown format {fmt}')
+
+
+def parse_storage(title: Any, geometry: Any) -> Storage:
+    """ returns a storage with the territory of the geometry, raises ValueError for invalid ones """
+    if isinstance(geometry, UnreadableRecord):
+        raise geometry
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError('Title is required')
+    title = title.strip()
+    if len(title) > Storage._meta.get_field('title').max_length:
+        raise ValueError('Title is too long')
+    if not geometry:
+        raise ValueError('Geometry is required')
+    try:
+        territory = GEOSGeometry(geometry.strip())
+    except (GEOSException, ValueError, TypeError) as e:
+        raise ValueError(f'Invalid geometry: {e}')
+    if territory.geom_type != 'Polygon':
+        raise ValueError(f'Expected Polygon, got {territory.geom_type}')
+    if not territory.valid:
+        raise ValueError(f'Invalid polygon: {territory.valid_reason}')
+    if territory.srid is None:
+        territory.srid = SRID
+    elif territory.srid != SRID:
+        territory.transform(SRID)
+    return Storage(title=title, territory=territory)
+
+
+def check_storages(sources: Iterable[Source]) -> Tuple[List[Tuple[str, Storage]], List[Conflict]]:
+    """ returns new storages and every conflict: invalid records, repeated titles,
+    overlaps inside the batch and with existing storages (by an in-memory index)
+    """
+    storages: List[Tuple[str, Storage]] = []
+    conflicts: List[Conflict] = []
+    for position, title, geometry in sources:
+        try:
+            storages.append((position, parse_storage(title, geometry)))
+        except ValueError as e:
+            conflicts.append((position, str(title or ''), str(e)))
+    titles: Dict[str, str] = {}
+    for position, storage in storages:
+        key = storage.title.lower()
+        if key in titles:
+            conflicts.append((position, storage.title, f'Repeats the title of {titles[key]}'))
+        titles.setdefault(key, position)
+    existing = Storage.objects.annotate(key=Lower('title')).filter(key__in=list(titles))
+    for title in existing.values_list('title', flat=True):
+        conflicts.append((titles.get(title.lower(), ''), title, 'A storage with the title exists'))
+    tree = STRtree(
+        (storage.territory.extent, (i, storage.territory.prepared))
+        for i, (_, storage) in enumerate(storages)
+    )
+    for i, (position, storage) in enumerate(storages):
+        for j, territory in tree.query(*storage.territory.extent):
+            if j > i and territory.intersects(storages[j][1].territory):
+                conflicts.append((storages[j][0], storages[j][1].title, f'Intersects {storage.title} of {position}'))
+        for storage_id in storage_index.intersecting(storage.territory):
+            conflicts.append((position, storage.title, f'Intersects the existing storage {storage_id}'))
+    return storages, conflicts
+
+
+@transaction.atomic
+def create_storages(storages: List[Storage]) -> List[Storage]:
+    """ inserts storages with bulk_create and does what signals of Storage.save() do:
+    finished trips are attached, running totals are created, caches are invalidated
+    """
+    storages = Storage.objects.bulk_create(storages)
+    created = Storage.objects.filter(id__in=[storage.id for storage in storages])
+    created.attach_trips()
+    StorageTotal.objects.rebuild(storage_ids=[storage.id for storage in storages])
+    storage_index.invalidate()
+    mark_changed(REPORT)
+    return storages
+
+
+def import_storages(lines: Iterable[str], fmt: str) -> Tuple[List[Storage], List[Conflict]]:
+    """ imports storages of a file if it has no conflicts,
+    returns created storages and conflicts
+    """
+    storages, conflicts = check_storages(read_sources(lines, fmt))
+    if conflicts:
+        return [], conflicts
+    return create_storages([storage for _, storage in storages]), []
@@ -0,0 +1,134 @@
+"""
+Reproducible synthetic pit data at mine scale
+"""
+import math
+import random
+from datetime import timedelta
+from typing import Dict, List, NamedTuple, Tuple
+from django.contrib.gis.geos import Point, Polygon
+from django.db import transaction
+from django.utils import timezone
+from pit.catalog import catalog
+from pit.models import (
+    TruckModel,
+    Truck,
+    Mineral,
+    Storage,
+    OtherStorageIncom,
+    Trip,
+    StorageTotal,
+)
+from pit.spatial import storage_index
+from pit.versions import REPORT, mark_changed
+
+
+class Scale(NamedTuple):
+    truck_models: int
+    trucks: int
+    storages: int
+    trips: int  # finished trips, every truck has an active trip besides
+    other_incoms: int  # not trip incoms of a storage
+
+
+SCALES = {
+    'small': Scale(truck_models=3, trucks=30, storages=5, trips=10000, other_incoms=2),
+    'medium': Scale(truck_models=5, trucks=200, storages=50, trips=200000, other_incoms=3),
+    'mine': Scale(truck_models=10, trucks=1000, storages=200, trips=2000000, other_incoms=5),
+}
+MAX_WEIGHTS = (90, 110, 120, 130, 220)
+CELL = 100  # every storage lies inside its own cell of a grid, so storages never overlap
+ORIGIN = (1000.0, 0.0)  # the grid is away from the storage of factory_reset
+BATCH_SIZE = 10000
+FAILED_SHARE = 0.05  # unloads at random points of the pit, the others are near storages
+SPREAD = 15  # standard deviation of unloading points around the center of a storage
+DAYS = 30  # finished trips are spread over the last days
+
+
+def storage_polygon(rnd: random.Random, x: float, y: float) -> Polygon:
+    """ returns an irregular outline of a stockpile inside the cell centered at x, y """
+    count = rnd.randint(8, 16)
+    points = []
+    for i in range(count):
+        angle = 2 * math.pi * i / count
+        radius = rnd.uniform(20, 45)
+        points.append((x + radius * math.cos(angle), y + radius * math.sin(angle)))
+    return Polygon(points + points[:1], srid=4326)
+
+
+def mineral(rnd: random.Random, weight: int) -> Mineral:
+    sio2 = rnd.randint(25, 40)
+    return Mineral(weight=weight, sio2=sio2, fe=rnd.randint(45, min(68, 99 - sio2)))
+
+
+def generate(seed: int = 0, scale: Scale = SCALES['small']) -> Dict[str, int]:
+    """ creates truck models, trucks with active trips, storages with not trip incoms
+    and finished trips unloaded mostly near storages, returns numbers of created rows.
+    The same seed and scale give the same data, titles and numbers are prefixed by the seed.
+    """
+    rnd = random.Random(seed)
+    prefix = f'G{seed}'
+    with transaction.atomic():
+        truck_models = TruckModel.objects.bulk_create(
+            TruckModel(title=f'{prefix} model {i}', max_weight=rnd.choice(MAX_WEIGHTS))
+            for i in range(scale.truck_models)
+        )
+        trucks = Truck.objects.bulk_create(
+            Truck(number=f'{prefix}-{i}', truck_model=rnd.choice(truck_models))
+            for i in range(scale.trucks)
+        )
+        columns = math.ceil(math.sqrt(scale.storages))
+        centers: List[Tuple[float, float]] = [
+            (ORIGIN[0] + (i % columns + 0.5) * CELL, ORIGIN[1] + (i // columns + 0.5) * CELL)
+            for i in range(scale.storages)
+        ]
+        storages = Storage.objects.bulk_create(
+            Storage(title=f'{prefix} storage {i}', territory=storage_polygon(rnd, x, y))
+            for i, (x, y) in enumerate(centers)
+        )
+        OtherStorageIncom.objects.bulk_create(
+            OtherStorageIncom(mineral=incom_mineral, storage=storages[i // scale.other_incoms])
+            for i, incom_mineral in enumerate(Mineral.objects.bulk_create(
+                mineral(rnd, rnd.randint(500, 1500)) for _ in range(scale.storages * scale.other_incoms)
+            ))
+        )
+        width, height = columns * CELL, math.ceil(scale.storages / columns) * CELL
+        now = timezone.now()
+        for offset in range(0, scale.trips, BATCH_SIZE):
+            trip_trucks = [rnd.choice(trucks) for _ in range(min(BATCH_SIZE, scale.trips - offset))]
+            minerals = Mineral.objects.bulk_create(
+                mineral(rnd, int(truck.truck_model.max_weight * rnd.uniform(0.8, 1.15)))
+                for truck in trip_trucks
+            )
+            trips = []
+            for truck, trip_mineral in zip(trip_trucks, minerals):
+                if rnd.random() < FAILED_SHARE:
+                    point = Point(ORIGIN[0] + rnd.uniform(0, width), ORIGIN[1] + rnd.uniform(0, height))
+                else:
+                    x, y = rnd.choice(centers)
+                    point = Point(rnd.gauss(x, SPREAD), rnd.gauss(y, SPREAD))
+                trips.append(Trip(
+                    truck=truck,
+                    mineral=trip_mineral,
+                    unloading_point=point,
+                    unloaded_at=now - timedelta(seconds=rnd.uniform(0, DAYS * 86400)),
+                ))
+            Trip.objects.bulk_create(trips)
+        Trip.objects.bulk_create(
+            Trip(truck=truck, mineral=trip_mineral)
+            for truck, trip_mineral in zip(trucks, Mineral.objects.bulk_create(
+                mineral(rnd, int(truck.truck_model.max_weight * rnd.uniform(0.8, 1.15))) for truck in trucks
+            ))
+        )
+        # bulk_create does not send signals, so do what Storage and Trip signals do
+        Storage.objects.filter(id__in=[storage.id for storage in storages]).attach_trips()
+        StorageTotal.objects.rebuild(storage_ids=[storage.id for storage in storages])
+        storage_index.invalidate()
+        catalog.invalidate()
+        mark_changed(REPORT)
+    return {
+        'truck_models': scale.truck_models,
+        'trucks': scale.trucks,
+        'storages': scale.storages,
+        'other_incoms': scale.storages * scale.other_incoms,
+        'trips': scale.trips + scale.trucks,
+    }
@@ -1,7 +1,25 @@
-from django.test import TestCase
+import csv
+import math
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from typing import Any
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 from django.db.utils import IntegrityError
-from django.core.exceptions import ValidationError
-from django.contrib.gis.geos import Point
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
+from django.http import HttpResponse
+from django.contrib.gis.geos import GEOSGeometry, Point, Polygon
 from .models import (
     TruckModel,
     Truck,
@@ -9,7 +27,25 @@ from .models import (
     Storage,
     OtherStorageIncom,
     Trip,
+    StorageTotal,
 )
+from pit.reports import storage_report, storage_totals_mismatches, cached_storage_report
+from pit.spatial import STRtree, TerritoryCache, storage_index
+from pit.versions import STORAGES, bump_version, get_version
+from pit.unloads import UnloadConflict, record_unloads
+from pit.ingest import parse_event, unload_trucks
+from pit.packed import HEADER, BatchTooLarge, encode, decode, decode_records
+from pit.uploads import upload_rows
+from pit.storage_import import import_storages
+from pit.fleet import import_fleet
+from pit.synthetic import Scale, generate
+from pit.benchmarks import views_benchmark
+from pit.utils import factory_reset
+from pit.snapshots import SnapshotError, create_snapshot, delete_snapshot, list_snapshots, restore_snapshot
+from pit.middleware import PerformanceMiddleware
+from pit.metrics import MetricsStore, exposition
+import pit.metrics as metrics
+from pit.writebehind import WriteBehindQueue, ack_status
 import pit.patterns as patterns
 
 
@@ -656,6 +692,1235 @@ class TripTest(TestCase):
         trip_101.save()
         self.assertEqual(trip_101.truck_model_title, trip_101.truck.model_title)
 
+    def test_property_storage(self):
+        """ the storage of a trip is resolved when the unloading point is set """
+        storage = Storage(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        storage.save()
+        trip = Trip(truck=self.t_101, mineral=self.m_101)
+        trip.save()
+        self.assertIsNone(trip.storage)
+        trip.xy = '20 20'
+        self.assertEqual(trip.storage, storage)
+        trip.save()
+        self.assertEqual(Trip.objects.get(id=trip.id).storage, storage)
+        trip.xy = '40 30'
+        self.assertIsNone(trip.storage)
+
+    def test_storage_attaches_trips(self):
+        """ a new storage becomes the storage of trips unloaded on its territory """
+        trip = Trip(truck=self.t_101, mineral=self.m_101, unloading_point=Point(20, 20))
+        trip.save()
+        self.assertEqual(trip.failed, True)
+        storage = Storage(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        storage.save()
+        trip = Trip.objects.get(id=trip.id)
+        self.assertEqual(trip.storage, storage)
+        self.assertEqual(trip.failed, False)
+        storage.delete()
+        trip = Trip.objects.get(id=trip.id)
+        self.assertIsNone(trip.storage)
+        self.assertEqual(trip.failed, True)
+
+
+class StorageTotalTest(TestCase):
+    """ tests for running totals of storages """
+
+    def setUp(self):
+        self.storage = Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        self.t_101 = Truck.objects.create(number=101, truck_model=tm_belaz)
+        self.m_101 = Mineral.objects.create(weight=100, sio2=32, fe=67)
+        self.m_storage = Mineral.objects.create(weight=900, sio2=34, fe=65)
+
+    def totals(self) -> StorageTotal:
+        return StorageTotal.objects.get(storage=self.storage)
+
+    def test_created_with_storage(self):
+        """ a new storage has empty totals """
+        total = self.totals()
+        self.assertEqual(total.other_weight, 0)
+        self.assertEqual(total.trips_weight, 0)
+
+    def test_other_storage_incom(self):
+        """ not trip incoms are added to and removed from totals """
+        incom = OtherStorageIncom.objects.create(mineral=self.m_storage, storage=self.storage)
+        total = self.totals()
+        self.assertEqual(total.other_weight, 900)
+        self.assertEqual(total.other_sio2, 900 * 34)
+        self.assertEqual(total.other_fe, 900 * 65)
+        incom.delete()
+        self.assertEqual(self.totals().other_weight, 0)
+
+    def test_trip_unloading(self):
+        """ a trip is added to totals when it gets an unloading point in the storage """
+        trip = Trip.objects.create(truck=self.t_101, mineral=self.m_101)
+        self.assertEqual(self.totals().trips_weight, 0)
+        trip = Trip.objects.get(id=trip.id)
+        trip.xy = '20 20'
+        trip.save()
+        total = self.totals()
+        self.assertEqual(total.trips_weight, 100)
+        self.assertEqual(total.trips_sio2, 100 * 32)
+        self.assertEqual(total.trips_fe, 100 * 67)
+        trip.save()  # saving again does not change totals
+        self.assertEqual(self.totals().trips_weight, 100)
+        trip.delete()
+        self.assertEqual(self.totals().trips_weight, 0)
+
+    def test_trip_unloading_out_of_storage(self):
+        """ a failed unloading does not change totals """
+        trip = Trip.objects.create(truck=self.t_101, mineral=self.m_101)
+        trip.xy = '40 30'
+        trip.save()
+        self.assertEqual(self.totals().trips_weight, 0)
+
+    def test_report(self):
+        """ report rows are built from totals and match the report query """
+        OtherStorageIncom.objects.create(mineral=self.m_storage, storage=self.storage)
+        Trip.objects.create(truck=self.t_101, mineral=self.m_101, unloading_point='POINT(20 20)')
+        self.assertEqual(storage_report(), [{
+            'title': 'Sklad1',
+            'weight_before': 900,
+            'sum_weight_after': 1000,
+            'quality_after': '33% SiO2, 65% Fe',
+        }])
+        self.assertEqual(storage_totals_mismatches(), [])
+        StorageTotal.objects.update(trips_weight=0)
+        self.assertEqual(len(storage_totals_mismatches()), 1)
+        StorageTotal.objects.rebuild()
+        self.assertEqual(storage_totals_mismatches(), [])
+
+
+class TerritoryCacheTest(TestCase):
+    """ tests for the cache of prepared territories of storages """
+
+    def test_load(self):
+        """ only new and changed territories are fetched """
+        storage = Storage.objects.create(title='Sklad1', territory=Polygon.from_bbox((0, 0, 10, 10)))
+        Storage.objects.create(title='Sklad2', territory=Polygon.from_bbox((20, 0, 30, 10)))
+        territories = TerritoryCache()
+        with self.assertNumQueries(2):
+            loaded = territories.load()
+        self.assertTrue(loaded[storage.id].prepared.covers(Point(5, 5)))
+        with self.assertNumQueries(1):
+            self.assertIs(territories.load()[storage.id], loaded[storage.id])
+        storage.territory = Polygon.from_bbox((0, 0, 5, 5))
+        storage.save()
+        with self.assertNumQueries(2):
+            self.assertEqual(territories.load()[storage.id].geometry, storage.territory)
+        storage.delete()
+        self.assertIsNone(territories.load().get(storage.id))
+
+    def test_lookups_in_transaction(self):
+        """ after a change the transaction rebuilds the index once, only if territories changed """
+        storage = Storage.objects.create(title='Sklad1', territory=Polygon.from_bbox((0, 0, 10, 10)))
+        storage_index.locate(Point(5, 5))
+        with transaction.atomic():
+            storage_index.invalidate()
+            with self.assertNumQueries(1):  # hashes of territories, nothing is fetched or parsed
+                self.assertEqual(storage_index.locate(Point(5, 5)), storage.id)
+            with self.assertNumQueries(0):
+                self.assertEqual(storage_index.locate(Point(5, 5)), storage.id)
+                self.assertEqual(storage_index.intersecting(Polygon.from_bbox((5, 5, 20, 20))), [storage.id])
+            storage.title = 'Sklad2'
+            storage.save()
+            with self.assertNumQueries(0):
+                storage.validate_unique()
+
+
+class SpatialIndexTest(TestCase):
+    """ tests for the in-process spatial index of storages """
+
+    def test_strtree(self):
+        """ the tree returns exactly values with intersecting envelopes """
+        items = [((x, y, x + 1, y + 1), (x, y)) for x in range(0, 40, 2) for y in range(0, 40, 2)]
+        tree = STRtree(items, node_capacity=4)
+        self.assertGreater(tree.height, 1)
+        self.assertEqual(sorted(tree.query(3, 3, 4.5, 4.5)), [(2, 2), (2, 4), (4, 2), (4, 4)])
+        self.assertEqual(list(tree.query(1.5, 1.5, 1.6, 1.6)), [])
+        self.assertEqual(list(STRtree([]).query(0, 0, 1, 1)), [])
+
+    def test_locate(self):
+        """ points are located in storages which cover them """
+        self.assertIsNone(storage_index.locate(Point(20, 20)))
+        storage1 = Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        storage2 = Storage.objects.create(
+            title='Sklad2',
+            territory='POLYGON ((40 10, 50 10, 50 20, 40 20, 40 10))'
+        )
+        self.assertEqual(
+            storage_index.locate_many([Point(20, 20), Point(30, 10), Point(45, 15), Point(40, 30), None]),
+            [storage1.id, storage1.id, storage2.id, None, None]
+        )
+        storage2.delete()
+        self.assertIsNone(storage_index.locate(Point(45, 15)))
+
+    def test_version_checks(self):
+        """ the shared version is read at most every CHECK_INTERVAL, changes of other processes are seen then """
+        storage_index.locate(Point(20, 20))
+        with mock.patch('pit.spatial.get_version', wraps=get_version) as version:
+            storage_index.locate(Point(20, 20))
+            storage_index.locate_many([Point(20, 20), Point(45, 15)])
+            self.assertEqual(version.call_count, 0)
+            bump_version(STORAGES)  # another process changed storages
+            with mock.patch('pit.spatial.CHECK_INTERVAL', 0):
+                storage_index.locate(Point(20, 20))
+            self.assertEqual(version.call_count, 1)
+
+    def test_rollback(self):
+        """ a transaction sees its own storages, they are gone after its rollback """
+        try:
+            with transaction.atomic():
+                storage = Storage.objects.create(
+                    title='Sklad1',
+                    territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+                )
+                self.assertEqual(storage_index.locate(Point(20, 20)), storage.id)
+                raise IntegrityError('rollback')
+        except IntegrityError:
+            pass
+        self.assertIsNone(storage_index.locate(Point(20, 20)))
 
 
+class StorageQualityTotalsTest(TestCase):
+    """ tests for Storage.objects.with_quality_totals() """
 
+    def test_with_quality_totals(self):
+        """ totals of storages are annotated in the query of storages """
+        storage1 = Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        storage2 = Storage.objects.create(
+            title='Sklad2',
+            territory='POLYGON ((40 10, 50 10, 50 20, 40 20, 40 10))'
+        )
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        t_101 = Truck.objects.create(number=101, truck_model=tm_belaz)
+        t_102 = Truck.objects.create(number=102, truck_model=tm_belaz)
+        OtherStorageIncom.objects.create(
+            mineral=Mineral.objects.create(weight=900, sio2=34, fe=65),
+            storage=storage1,
+        )
+        Trip.objects.create(
+            truck=t_101, mineral=Mineral.objects.create(weight=100, sio2=32, fe=67),
+            unloading_point=Point(20, 20),
+        )
+        Trip.objects.create(
+            truck=t_101, mineral=Mineral.objects.create(weight=120, sio2=35, fe=62),
+            unloading_point=Point(40, 30),  # out of storages
+        )
+        Trip.objects.create(
+            truck=t_102, mineral=Mineral.objects.create(weight=125, sio2=30, fe=65),
+        )
+        with self.assertNumQueries(1):
+            storages = {s.title: s for s in Storage.objects.with_quality_totals()}
+        totals = storages['Sklad1']
+        self.assertEqual(
+            (totals.other_weight, totals.other_sio2, totals.other_fe),
+            (900, 900 * 34, 900 * 65)
+        )
+        self.assertEqual(
+            (totals.trips_weight, totals.trips_sio2, totals.trips_fe),
+            (100, 100 * 32, 100 * 67)
+        )
+        self.assertEqual(storages['Sklad2'].other_weight, 0)
+        self.assertEqual(storages['Sklad2'].trips_weight, 0)
+        self.assertEqual(
+            Storage.objects.with_quality_totals().get(id=storage2.id).trips_weight, 0
+        )
+
+    def test_order_and_iterator(self):
+        """ totals can be ordered and filtered by and are fetched by iterator() too """
+        storages = [
+            Storage.objects.create(
+                title=f'Sklad{i}',
+                territory=f'POLYGON (({i * 10} 0, {i * 10 + 10} 0, {i * 10 + 10} 10, {i * 10} 10, {i * 10} 0))'
+            )
+            for i in range(3)
+        ]
+        truck = Truck.objects.create(number=101, truck_model=TruckModel.objects.create(title='БЕЛАЗ', max_weight=120))
+        for storage, weight in zip(storages, (50, 110)):
+            Trip.objects.create(
+                truck=truck, mineral=Mineral.objects.create(weight=weight, sio2=30, fe=60),
+                unloading_point=Point(storage.territory.centroid.x, storage.territory.centroid.y),
+            )
+        OtherStorageIncom.objects.create(mineral=Mineral.objects.create(weight=70, sio2=30, fe=60), storage=storages[0])
+        with self.assertNumQueries(1):
+            totals = [
+                (storage.title, storage.trips_weight, storage.other_weight)
+                for storage in Storage.objects.with_quality_totals().order_by('-trips_weight').iterator()
+            ]
+        self.assertEqual(totals, [('Sklad1', 110, 0), ('Sklad0', 50, 70), ('Sklad2', 0, 0)])
+        self.assertEqual(
+            list(Storage.objects.with_quality_totals().filter(trips_sio2__gt=0).order_by('title')
+                 .values_list('title', 'trips_sio2')),
+            [('Sklad0', 50 * 30), ('Sklad1', 110 * 30)]
+        )
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedReportTest(TransactionTestCase):
+    """ tests for the versioned cache of the storage report """
+
+    def test_cached_report(self):
+        """ the report is cached until the data changes """
+        storage = Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        report = cached_storage_report()
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_storage_report(), report)
+        OtherStorageIncom.objects.create(
+            mineral=Mineral.objects.create(weight=900, sio2=34, fe=65),
+            storage=storage,
+        )
+        self.assertEqual(cached_storage_report()[0]['weight_before'], 900)
+
+    def test_single_flight(self):
+        """ concurrent requests wait for one calculation of the report """
+        calls = []
+
+        def slow_report():
+            calls.append(1)
+            time.sleep(0.2)
+            return [{'title': 'Sklad1'}]
+
+        with mock.patch('pit.reports.storage_report', slow_report):
+            threads = [threading.Thread(target=cached_storage_report) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+
+
+class ExportTest(TestCase):
+    """ tests for streaming exports """
+
+    def setUp(self):
+        self.storage = Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        t_101 = Truck.objects.create(number=101, truck_model=tm_belaz)
+        t_102 = Truck.objects.create(number=102, truck_model=tm_belaz)
+        self.trip_in = Trip.objects.create(
+            truck=t_101, mineral=Mineral.objects.create(weight=100, sio2=32, fe=67),
+            unloading_point=Point(20, 20),
+        )
+        self.trip_out = Trip.objects.create(
+            truck=t_101, mineral=Mineral.objects.create(weight=120, sio2=35, fe=62),
+            unloading_point=Point(40, 30),
+        )
+        Trip.objects.create(truck=t_102, mineral=Mineral.objects.create(weight=125, sio2=30, fe=65))
+
+    def test_trips_csv(self):
+        """ finished trips are streamed as CSV """
+        response = self.client.get('/export/trips.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [
+            'id,truck_number,truck_model,truck_max_weight,weight,sio2,fe,x,y,storage,failed',
+            f'{self.trip_in.id},101,БЕЛАЗ,120,100,32,67,20.0,20.0,Sklad1,False',
+            f'{self.trip_out.id},101,БЕЛАЗ,120,120,35,62,40.0,30.0,,True',
+        ])
+
+    def test_report_ndjson(self):
+        """ the storage report is streamed as NDJSON """
+        response = self.client.get('/export/report.ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows, [{
+            'title': 'Sklad1',
+            'weight_before': 0,
+            'sum_weight_after': 100,
+            'quality_after': '32% SiO2, 67% Fe',
+        }])
+        self.assertEqual(self.client.get('/export/trucks.csv').status_code, 404)
+
+    def test_storages_csv(self):
+        """ territories of storages are exported as CSV accepted by import_storages """
+        response = self.client.get('/export/storages.csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['title', 'wkb'])
+        self.assertEqual(rows[1][0], 'Sklad1')
+        self.assertEqual(GEOSGeometry(rows[1][1]), self.storage.territory)
+
+    def test_command(self):
+        """ the export command writes the same data """
+        output = StringIO()
+        call_command('export_pit', 'trips', '--format', 'ndjson', '--chunk-size', '1', stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 2)
+
+
+class TripDashboardTest(TestCase):
+    """ tests for Trip.objects.dashboard() """
+
+    def setUp(self):
+        self.tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+
+    def add_trips(self, count: int, offset: int = 0) -> None:
+        for i in range(offset, offset + count):
+            Trip.objects.create(
+                truck=Truck.objects.create(number=f'T{i}', truck_model=self.tm_belaz),
+                mineral=Mineral.objects.create(weight=150, sio2=30, fe=65),
+            )
+
+    def test_annotated_properties(self):
+        """ dashboard properties are read from annotations """
+        self.add_trips(1)
+        trip = Trip.objects.active().dashboard().get()
+        with self.assertNumQueries(0):
+            self.assertEqual(trip.truck_number, 'T0')
+            self.assertEqual(trip.truck_model_title, 'БЕЛАЗ')
+            self.assertEqual(trip.truck_max_weight, 120)
+            self.assertEqual(trip.mineral_weight, 150)
+            self.assertEqual(trip.overload, 25)
+        self.assertEqual(Trip.objects.get(id=trip.id).overload, 25)
+
+    def test_index_queries(self):
+        """ the index page makes the same number of queries for any number of trips """
+        self.add_trips(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/')
+        self.add_trips(10, offset=2)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get('/')
+        self.assertContains(response, 'T11')
+        self.assertEqual(len(few), len(many))
+
+
+class TripFailedTest(TestCase):
+    """ tests for Trip.objects.with_failed() and failed_unloads() """
+
+    def setUp(self):
+        Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        self.t_101 = Truck.objects.create(number=101, truck_model=tm_belaz)
+        t_102 = Truck.objects.create(number=102, truck_model=tm_belaz)
+        self.trip_in = Trip.objects.create(
+            truck=self.t_101, mineral=Mineral.objects.create(weight=100, sio2=32, fe=67),
+            unloading_point=Point(20, 20),
+        )
+        self.trip_out = Trip.objects.create(
+            truck=self.t_101, mineral=Mineral.objects.create(weight=120, sio2=35, fe=62),
+            unloading_point=Point(40, 30),
+        )
+        self.trip_active = Trip.objects.create(
+            truck=t_102, mineral=Mineral.objects.create(weight=125, sio2=30, fe=65),
+        )
+
+    def test_with_failed(self):
+        """ the failed flag of all trips is calculated by one query """
+        with self.assertNumQueries(1):
+            failed = {trip.id: trip.failed for trip in Trip.objects.with_failed()}
+        self.assertEqual(failed, {
+            self.trip_in.id: False,
+            self.trip_out.id: True,
+            self.trip_active.id: False,
+        })
+
+    def test_failed_unloads(self):
+        """ failed unloads are filtered by the time of unloading """
+        self.assertIsNone(self.trip_active.unloaded_at)
+        self.assertIsNotNone(self.trip_out.unloaded_at)
+        now = timezone.now()
+        self.assertEqual(list(Trip.objects.failed_unloads()), [self.trip_out])
+        self.assertEqual(list(Trip.objects.failed_unloads(since=now - timedelta(hours=1), until=now)),
+                         [self.trip_out])
+        self.assertEqual(list(Trip.objects.failed_unloads(since=now)), [])
+
+    def test_unloaded_at(self):
+        """ the time of unloading is set when a trip is unloaded, not on later saves """
+        self.trip_active.xy = '40 30'
+        self.trip_active.save()
+        self.assertIsNotNone(self.trip_active.unloaded_at)
+        Trip.objects.filter(id=self.trip_out.id).update(unloaded_at=None)  # finished before the field existed
+        trip = Trip.objects.get(id=self.trip_out.id)
+        trip.save()
+        self.assertIsNone(Trip.objects.get(id=trip.id).unloaded_at)
+        self.assertEqual(list(Trip.objects.failed_unloads(since=timezone.now() - timedelta(hours=1))),
+                         [self.trip_active])
+
+
+@mock.patch('pit.board.BOARD_PAGE_SIZE', 2)
+class TripBoardTest(TestCase):
+    """ tests for pages of active trips on the index page """
+
+    def setUp(self):
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        self.tm_komatsu = TruckModel.objects.create(title='Komatsu', max_weight=110)
+        self.trips = [
+            Trip.objects.create(
+                truck=Truck.objects.create(number=number, truck_model=truck_model),
+                mineral=Mineral.objects.create(weight=weight, sio2=30, fe=65),
+            )
+            for number, truck_model, weight in (
+                ('101', tm_belaz, 100),
+                ('102', tm_belaz, 125),
+                ('K103', self.tm_komatsu, 120),
+                ('K104', self.tm_komatsu, 100),
+                ('105', tm_belaz, 110),
+            )
+        ]
+
+    def page_ids(self, query: str = '') -> list:
+        response = self.client.get(f'/?{query}')
+        return [form.instance.id for form in response.context['formset'].forms]
+
+    def test_pages(self):
+        """ trips are paginated by id """
+        ids = [trip.id for trip in self.trips]
+        self.assertEqual(self.page_ids(), ids[:2])
+        self.assertEqual(self.page_ids(f'after={ids[1]}'), ids[2:4])
+        self.assertEqual(self.page_ids(f'after={ids[3]}'), ids[4:])
+        self.assertEqual(self.page_ids(f'before={ids[4]}'), ids[2:4])
+        response = self.client.get(f'/?after={ids[1]}')
+        self.assertEqual(response.context['next_query'], f'after={ids[3]}')
+        self.assertEqual(response.context['previous_query'], f'before={ids[2]}')
+
+    def test_filters(self):
+        """ trips are filtered by truck model, number prefix and overload """
+        self.assertEqual(self.page_ids(f'truck_model={self.tm_komatsu.id}'),
+                         [self.trips[2].id, self.trips[3].id])
+        self.assertEqual(self.page_ids('number=k'), [self.trips[2].id, self.trips[3].id])
+        self.assertEqual(self.page_ids('overloaded=on'), [self.trips[1].id, self.trips[2].id])
+
+    def test_post_page(self):
+        """ posting a page unloads its trips only """
+        page = self.trips[:2]
+        data = {
+            'form-TOTAL_FORMS': '2',
+            'form-INITIAL_FORMS': '2',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+        }
+        for i, trip in enumerate(page):
+            data[f'form-{i}-id'] = str(trip.id)
+            data[f'form-{i}-xy'] = '20 20'
+        response = self.client.post('/', data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Trip.objects.active().count(), 3)
+        response = self.client.post('/', data)  # the page is already unloaded
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['formset'].non_form_errors())
+
+
+class RecordUnloadsTest(TestCase):
+    """ tests for bulk recording of unloads """
+
+    def setUp(self):
+        self.storage = Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        self.tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+
+    def add_trips(self, count: int, offset: int = 0) -> list:
+        return [
+            Trip.objects.create(
+                truck=Truck.objects.create(number=f'T{i}', truck_model=self.tm_belaz),
+                mineral=Mineral.objects.create(weight=100, sio2=30, fe=65),
+            )
+            for i in range(offset, offset + count)
+        ]
+
+    def unload(self, trips: list) -> list:
+        return [(trip.id, Point(20, 20), None) for trip in trips]
+
+    def test_record_unloads(self):
+        """ unloads are saved with storages, times and storage totals """
+        trips = self.add_trips(3)
+        unloaded, skipped = record_unloads(self.unload(trips[:2]) + [(trips[2].id, Point(40, 30), None)])
+        self.assertEqual(len(unloaded), 3)
+        self.assertEqual(skipped, [])
+        trip = Trip.objects.get(id=trips[0].id)
+        self.assertEqual(trip.storage, self.storage)
+        self.assertIsNotNone(trip.unloaded_at)
+        self.assertEqual(Trip.objects.get(id=trips[2].id).failed, True)
+        self.assertEqual(StorageTotal.objects.get(storage=self.storage).trips_weight, 200)
+        self.assertEqual(storage_totals_mismatches(), [])
+
+    def test_conflict(self):
+        """ trips which are not active are not unloaded again """
+        trips = self.add_trips(2)
+        record_unloads(self.unload(trips[:1]))
+        with self.assertRaises(UnloadConflict):
+            record_unloads(self.unload(trips))
+        self.assertEqual(Trip.objects.active().count(), 1)
+        unloaded, skipped = record_unloads(self.unload(trips), strict=False)
+        self.assertEqual(skipped, [trips[0].id])
+        self.assertEqual(Trip.objects.active().count(), 0)
+
+    def test_constant_queries(self):
+        """ the number of queries does not depend on the number of unloads """
+        few = self.add_trips(5)
+        many = self.add_trips(50, offset=5)
+        with CaptureQueriesContext(connection) as few_queries:
+            record_unloads(self.unload(few))
+        with CaptureQueriesContext(connection) as many_queries:
+            record_unloads(self.unload(many))
+        self.assertEqual(len(few_queries), len(many_queries))
+
+
+class UnloadEventsTest(TestCase):
+    """ tests for the JSON ingestion endpoint of unload events """
+
+    def setUp(self):
+        Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        self.trips = [
+            Trip.objects.create(
+                truck=Truck.objects.create(number=number, truck_model=tm_belaz),
+                mineral=Mineral.objects.create(weight=100, sio2=30, fe=65),
+            )
+            for number in ('A101', 'A102')
+        ]
+
+    def post(self, body: Any) -> Any:
+        return self.client.post(reverse('unload_events'), json.dumps(body), content_type='application/json')
+
+    def test_parse_event(self):
+        """ coordinates follow patterns.XY """
+        self.assertEqual(parse_event({'truck_number': '101', 'x': 1.5, 'y': '2'})[1], Point(1.5, 2))
+        for event in ({'x': 1, 'y': 2}, {'truck_number': '101', 'x': 'a', 'y': 2},
+                      {'truck_number': '101', 'x': True, 'y': 2}, [1, 2]):
+            with self.assertRaises(ValueError):
+                parse_event(event)
+
+    def test_unload_events(self):
+        """ valid events unload trips, invalid ones get errors in place """
+        response = self.post({'events': [
+            {'truck_number': 'a101', 'x': 20, 'y': 20},
+            {'truck_number': 'A999', 'x': 20, 'y': 20},
+            {'truck_number': 'A102', 'x': 'bad', 'y': 20},
+            {'truck_number': 'A101', 'x': 21, 'y': 21},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(results[0], {'index': 0, 'status': 'ok', 'trip': self.trips[0].id, 'failed': False})
+        self.assertEqual([result['status'] for result in results], ['ok', 'error', 'error', 'error'])
+        self.assertEqual(list(Trip.objects.active()), [self.trips[1]])
+        self.assertEqual(storage_totals_mismatches(), [])
+        response = self.post({'events': [{'truck_number': 'A102', 'x': 0, 'y': 0}]})
+        self.assertEqual(response.json()['results'][0]['failed'], True)
+
+    def test_malformed(self):
+        """ a body without a list of events is rejected """
+        self.assertEqual(self.post({'event': []}).status_code, 400)
+        self.assertEqual(self.post({'events': {}}).status_code, 400)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class WriteBehindTest(TestCase):
+    """ tests for the write-behind queue of unload events """
+
+    def setUp(self):
+        Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        self.trips = [
+            Trip.objects.create(
+                truck=Truck.objects.create(number=number, truck_model=tm_belaz),
+                mineral=Mineral.objects.create(weight=100, sio2=30, fe=65),
+            )
+            for number in ('A101', 'A102')
+        ]
+        self.queue = WriteBehindQueue(autostart=False)
+
+    def test_queue_unload_events(self):
+        """ batches are acknowledged at once and unloaded on flush """
+        with mock.patch('pit.views.unload_queue', self.queue):
+            acks = [
+                self.client.post(reverse('queue_unload_events'), json.dumps({'events': events}),
+                                 content_type='application/json').json()['ack']
+                for events in ([{'truck_number': 'A101', 'x': 20, 'y': 20}, {'truck_number': 'A101'}],
+                               [{'truck_number': 'A102', 'x': 0, 'y': 0}])
+            ]
+        self.assertEqual(Trip.objects.active().count(), 2)
+        self.assertEqual(self.client.get(reverse('unload_ack', args=[acks[0]])).json(), {'status': 'queued'})
+        self.queue.drain()
+        first = self.client.get(reverse('unload_ack', args=[acks[0]])).json()
+        self.assertEqual(first['status'], 'done')
+        self.assertEqual([result['status'] for result in first['results']], ['ok', 'error'])
+        self.assertEqual(ack_status(acks[1])['results'][0]['failed'], True)
+        self.assertEqual(Trip.objects.active().count(), 0)
+        self.assertIsNotNone(Trip.objects.get(id=self.trips[0].id).unloaded_at)
+        self.assertEqual(self.client.get(reverse('unload_ack', args=['unknown'])).status_code, 404)
+
+    def test_batches(self):
+        """ a flush takes at most flush_size events """
+        queue = WriteBehindQueue(flush_size=1, autostart=False)
+        for trip in self.trips:
+            queue.put(trip.truck.number, [None], [(trip.truck.number, Point(20, 20), None)])
+        with mock.patch('pit.writebehind.unload_trucks', wraps=unload_trucks) as unload:
+            queue.drain()
+        self.assertEqual(unload.call_count, 2)
+        self.assertEqual(ack_status('A101')['status'], 'done')
+
+    def test_interval_after_idle(self):
+        """ the flush interval starts with the first event, so events after an idle queue are batched """
+        queue = WriteBehindQueue(flush_interval=0.2, autostart=False)
+
+        def put_later():
+            time.sleep(0.3)
+            for trip in self.trips:
+                queue.put(trip.truck.number, [None], [(trip.truck.number, Point(20, 20), None)])
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=put_later)
+        thread.start()
+        batch, stopping = queue._take()
+        thread.join()
+        self.assertEqual(len(batch), 2)
+        self.assertFalse(stopping)
+
+
+class PackedTest(TestCase):
+    """ tests for binary packed batches of unload events """
+
+    def test_decode(self):
+        """ records survive encoding with and without WKB points """
+        records = [(1, 20.5, 30.0, 1600000000.0), (2, -1.0, 2.0, None)]
+        for wkb in (False, True):
+            self.assertEqual(decode_records(encode(records, wkb=wkb)), records)
+        unloads = decode(encode(records))
+        self.assertEqual(unloads[0][1], Point(20.5, 30))
+        self.assertEqual(unloads[0][2], datetime.fromtimestamp(1600000000, dt_timezone.utc))
+        self.assertIsNone(unloads[1][2])
+
+    def test_malformed(self):
+        """ malformed batches are rejected """
+        data = encode([(1, 20.5, 30.0, None)])
+        for batch in (b'', b'PIT2' + data[4:], data[:-1], data + b'\0'):
+            with self.assertRaises(ValueError):
+                decode(batch)
+
+    def test_invalid_records(self):
+        """ coordinates which are not finite and timestamps out of range reject the batch """
+        for record in ((1, math.nan, 30.0, None), (1, 20.5, math.inf, None),
+                       (1, 20.5, 30.0, math.inf), (1, 20.5, 30.0, -1.0), (1, 20.5, 30.0, 1e20)):
+            for wkb in (False, True):
+                with self.assertRaises(ValueError):
+                    decode(encode([record], wkb=wkb))
+
+    def test_max_count(self):
+        """ the count of the header is checked before records are unpacked """
+        data = encode([(1, 20.5, 30.0, None)] * 3)
+        with self.assertRaises(BatchTooLarge):
+            decode_records(data[:HEADER.size], max_count=2)
+        self.assertEqual(len(decode(data, max_count=3)), 3)
+        with mock.patch('pit.views.INGEST_MAX_EVENTS', 2):
+            response = self.client.post(reverse('unload_packed_events'), data, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 413)
+
+    def test_unload_packed_events(self):
+        """ trips of trucks are unloaded by a packed batch """
+        Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        truck = Truck.objects.create(number='A101', truck_model=tm_belaz)
+        trip = Trip.objects.create(truck=truck, mineral=Mineral.objects.create(weight=100, sio2=30, fe=65))
+        response = self.client.post(
+            reverse('unload_packed_events'),
+            encode([(truck.id, 20, 20, 1600000000.0), (truck.id + 1, 20, 20, None)]),
+            content_type='application/octet-stream',
+        )
+        self.assertEqual([result['status'] for result in response.json()['results']], ['ok', 'error'])
+        trip = Trip.objects.get(id=trip.id)
+        self.assertEqual(trip.unloading_point, Point(20, 20))
+        self.assertEqual(trip.unloaded_at, datetime.fromtimestamp(1600000000, dt_timezone.utc))
+        self.assertEqual(storage_totals_mismatches(), [])
+        self.assertEqual(
+            self.client.post(reverse('unload_packed_events'), b'PIT', content_type='application/octet-stream').status_code,
+            400
+        )
+
+
+class UploadTest(TestCase):
+    """ tests for the CSV upload of unloads """
+
+    def setUp(self):
+        Storage.objects.create(
+            title='Sklad1',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+        )
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        for number in ('A101', 'A102', 'A103'):
+            Trip.objects.create(
+                truck=Truck.objects.create(number=number, truck_model=tm_belaz),
+                mineral=Mineral.objects.create(weight=100, sio2=30, fe=65),
+            )
+        self.csv = 'truck_number,xy\nA101,20 20\n\nA102,bad\nA103,0 0\nA999,20 20\nA101,21 21\n'
+
+    def test_upload_rows(self):
+        """ rows are unloaded by chunks, errors keep line numbers """
+        with mock.patch('pit.uploads.unload_trucks', wraps=unload_trucks) as unload:
+            results = list(upload_rows(StringIO(self.csv), chunk_size=2))
+        self.assertEqual(unload.call_count, 3)
+        self.assertEqual(
+            [(line, number, result['status']) for line, number, result in results],
+            [(2, 'A101', 'ok'), (4, 'A102', 'error'), (5, 'A103', 'ok'),
+             (6, 'A999', 'error'), (7, 'A101', 'error')]
+        )
+        self.assertEqual(Trip.objects.active().get().truck.number, 'A102')
+        self.assertEqual(storage_totals_mismatches(), [])
+
+    def test_upload_page(self):
+        """ the page shows counts and errors of rows """
+        response = self.client.post(reverse('upload'), {
+            'file': SimpleUploadedFile('shift.csv', self.csv.encode('utf-8-sig')),
+        })
+        report = response.context['report']
+        self.assertEqual((report.rows, report.unloaded, report.failed, report.error_count), (5, 2, 1, 3))
+        self.assertEqual(report.errors[0][:2], (4, 'A102'))
+
+    def test_unreadable_file(self):
+        """ files which are not UTF-8 CSV get a form error instead of a server error """
+        for content in ('A101,20 20\nБЕЛАЗ,20 20\n'.encode('cp1251'),
+                        ('A101,"' + 'x' * (csv.field_size_limit() + 1) + '"\n').encode()):
+            response = self.client.post(reverse('upload'), {'file': SimpleUploadedFile('shift.csv', content)})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].has_error('file'))
+
+    def test_command(self):
+        """ the command writes rows with errors """
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(self.csv)
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('upload_unloads', file.name, stdout=out, stderr=StringIO())
+        self.assertEqual([row[:2] for row in csv.reader(StringIO(out.getvalue()))],
+                         [['4', 'A102'], ['6', 'A999'], ['7', 'A101']])
+
+
+class StorageImportTest(TestCase):
+    """ tests for the bulk import of storages """
+
+    def feature(self, title: str, bbox: tuple) -> str:
+        return json.dumps({
+            'type': 'Feature',
+            'properties': {'title': title},
+            'geometry': json.loads(Polygon.from_bbox(bbox).json),
+        }) + '\n'
+
+    def setUp(self):
+        self.storage = Storage.objects.create(title='Sklad1', territory=Polygon.from_bbox((0, 0, 10, 10)))
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        self.trip = Trip.objects.create(
+            truck=Truck.objects.create(number='A101', truck_model=tm_belaz),
+            mineral=Mineral.objects.create(weight=100, sio2=30, fe=65),
+        )
+        self.trip.xy = '105 105'
+        self.trip.save()
+
+    def test_conflicts(self):
+        """ every conflict is reported and nothing is imported """
+        storages, conflicts = import_storages([
+            self.feature('Sklad2', (100, 100, 110, 110)),
+            self.feature('sklad2', (200, 200, 210, 210)),
+            self.feature('Sklad3', (105, 105, 120, 120)),
+            self.feature('SKLAD1', (5, 5, 20, 20)),
+            self.feature('', (300, 300, 310, 310)),
+            '{"type": "Feature", ',
+        ], 'geojsonseq')
+        self.assertEqual(storages, [])
+        self.assertEqual(sorted((position, description.split()[0]) for position, _, description in conflicts), [
+            ('line 2', 'Repeats'),
+            ('line 3', 'Intersects'),
+            ('line 4', 'A'),
+            ('line 4', 'Intersects'),
+            ('line 5', 'Title'),
+            ('line 6', 'Invalid'),
+        ])
+        self.assertEqual(Storage.objects.count(), 1)
+
+    def test_import(self):
+        """ storages are created with trips, totals and the spatial index """
+        wkb = Polygon.from_bbox((100, 100, 110, 110)).hex.decode()
+        storages, conflicts = import_storages(
+            ['title,wkb\n', f'Sklad2,{wkb}\n', f'Sklad3,"{Polygon.from_bbox((200, 0, 210, 10)).wkt}"\n'],
+            'wkb',
+        )
+        self.assertEqual(conflicts, [])
+        self.assertEqual(Trip.objects.get(id=self.trip.id).storage, storages[0])
+        self.assertEqual(StorageTotal.objects.get(storage=storages[0]).trips_weight, 100)
+        self.assertEqual(storage_index.locate(Point(205, 5)), storages[1].id)
+        self.assertEqual(storage_totals_mismatches(), [])
+
+
+class LowerExactTest(TestCase):
+    """ tests for case-insensitive lookups which use indexes of IUniqueConstraint """
+
+    def setUp(self):
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        Truck.objects.bulk_create(Truck(number=f'A{i}', truck_model=tm_belaz) for i in range(1000))
+
+    def test_lower_exact(self):
+        """ __lower_exact matches ignore case """
+        self.assertEqual(Truck.objects.get(number__lower_exact='a101').number, 'A101')
+        self.assertEqual(TruckModel.objects.filter(title__lower_exact='белаз').count(), 1)
+        with self.assertRaises(ValidationError):
+            Truck(number='a101', truck_model=TruckModel.objects.get()).full_clean()
+
+    def test_index_is_used(self):
+        """ the plan of the lookup uses the unique index on LOWER(number) """
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = Truck.objects.filter(number__lower_exact='a101').explain()
+        self.assertIn('pit_truck_number_is_unique_ignore_case', plan)
+
+
+class FleetImportTest(TestCase):
+    """ tests for the bulk import of a fleet """
+
+    def setUp(self):
+        self.tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        Truck.objects.create(number='A101', truck_model=self.tm_belaz)
+
+    def test_conflicts(self):
+        """ all duplicates are reported at once with a constant number of queries """
+        with self.assertNumQueries(2):
+            trucks, truck_models, conflicts = import_fleet([
+                ('line 1', 'a101', 'белаз', 120),
+                ('line 2', 'B1', 'Komatsu', 100),
+                ('line 3', 'b1', 'Komatsu', 100),
+                ('line 4', 'B2', 'БеЛаЗ', 130),
+                ('line 5', 'B3', 'Komatsu', 90),
+            ])
+        self.assertEqual(trucks, [])
+        self.assertEqual(sorted(position for position, _, _ in conflicts), ['line 1', 'line 3', 'line 4', 'line 5'])
+        self.assertEqual(Truck.objects.count(), 1)
+
+    def test_import(self):
+        """ trucks are created with new and existing models """
+        response = self.client.post(reverse('fleet_import'), json.dumps({'trucks': [
+            {'number': 'B1', 'truck_model': 'белаз', 'max_weight': 120},
+            {'number': 'B2', 'truck_model': 'Komatsu', 'max_weight': 100},
+            {'number': 'B3', 'truck_model': 'KOMATSU', 'max_weight': '100'},
+        ]}), content_type='application/json')
+        self.assertEqual(response.json(), {'trucks': 3, 'truck_models': 1})
+        self.assertEqual(Truck.objects.get(number='B1').truck_model, self.tm_belaz)
+        self.assertEqual(Truck.objects.get(number='B3').truck_model.title, 'Komatsu')
+        response = self.client.post(reverse('fleet_import'), json.dumps({'trucks': [
+            {'number': 'b2', 'truck_model': 'Komatsu', 'max_weight': 100},
+        ]}), content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogTest(TransactionTestCase):
+    """ tests for the in-process catalog of truck models and trucks """
+
+    def test_catalog(self):
+        """ properties of trucks read the catalog, changes invalidate it """
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        for i in range(3):
+            Trip.objects.create(
+                truck=Truck.objects.create(number=f'A{i}', truck_model=tm_belaz),
+                mineral=Mineral.objects.create(weight=100, sio2=30, fe=65),
+            )
+        trips = list(Trip.objects.all())
+        with self.assertNumQueries(2):
+            self.assertEqual([trip.truck_max_weight for trip in trips], [120] * 3)
+        with self.assertNumQueries(0):
+            self.assertEqual([trip.truck_model_title for trip in trips], ['БЕЛАЗ'] * 3)
+            self.assertEqual([trip.truck_number for trip in trips], ['A0', 'A1', 'A2'])
+            self.assertEqual(trips[0].truck.max_weight, 120)
+        tm_belaz.max_weight = 90
+        tm_belaz.save()
+        self.assertEqual(trips[0].overload, 11)
+
+    def test_pending_changes(self):
+        """ inside a transaction with changes of the catalog properties walk FKs """
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        truck = Truck.objects.create(number='A1', truck_model=tm_belaz)
+        with transaction.atomic():
+            TruckModel.objects.filter(id=tm_belaz.id).update(max_weight=100)
+            tm_belaz.title = 'Belaz'
+            tm_belaz.save()
+            self.assertEqual(Truck.objects.get(id=truck.id).max_weight, 100)
+            transaction.set_rollback(True)
+        self.assertEqual(truck.model_title, 'БЕЛАЗ')
+
+
+class QueryPlanTest(TestCase):
+    """ tests that hot queries keep using indexes """
+
+    def setUp(self):
+        storage = Storage.objects.create(title='Sklad1', territory=Polygon.from_bbox((0, 0, 10, 10)))
+        Storage.objects.create(title='Sklad2', territory=Polygon.from_bbox((20, 0, 30, 10)))
+        tm_belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        trucks = Truck.objects.bulk_create(Truck(number=f'A{i}', truck_model=tm_belaz) for i in range(200))
+        minerals = Mineral.objects.bulk_create(Mineral(weight=100, sio2=30, fe=65) for _ in trucks)
+        Trip.objects.bulk_create(
+            Trip(truck=truck, mineral=mineral,
+                 unloading_point=Point(i % 40, 5) if i % 4 else None,
+                 storage=storage if i % 4 and i % 40 <= 10 else None,
+                 unloaded_at=timezone.now() if i % 4 else None)
+            for i, (truck, mineral) in enumerate(zip(trucks, minerals))
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_index_page(self):
+        """ pages of active trips are read from the partial index """
+        plan = Trip.objects.active().dashboard().order_by('id').values_list('id', flat=True)[:51].explain()
+        self.assertIn('pit_trip_active_id', plan)
+
+    def test_report_page(self):
+        """ the storage report reads storages and totals by primary keys """
+        plan = Storage.objects.select_related('storagetotal').order_by('id').explain()
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_failed(self):
+        """ failed unloads are read from the partial index, storages of points from GiST indexes """
+        plan = Trip.objects.failed_unloads(since=timezone.now() - timedelta(hours=1)).explain()
+        self.assertIn('pit_trip_failed_unloaded_at', plan)
+        plan = Trip.objects.filter(unloading_point__coveredby=Polygon.from_bbox((0, 0, 10, 10))).explain()
+        self.assertIn('pit_trip_unloading_point_id', plan)
+        plan = Storage.objects.filter(territory__covers=Point(5, 5)).explain()
+        self.assertIn('pit_storage_territory_id', plan)
+
+
+class SyntheticDataTest(TestCase):
+    """ tests for the synthetic data generator and the views benchmark """
+
+    scale = Scale(truck_models=2, trucks=5, storages=4, trips=300, other_incoms=2)
+
+    def test_generate(self):
+        """ data is consistent and reproducible """
+        def points() -> list:
+            with transaction.atomic():
+                generate(seed=1, scale=self.scale)
+                result = [(trip.truck.number, trip.unloading_point.coords)
+                          for trip in Trip.objects.filter(unloading_point__isnull=False).order_by('id')]
+                transaction.set_rollback(True)
+            return result
+
+        self.assertEqual(points(), points())
+        counts = generate(seed=1, scale=self.scale)
+        self.assertEqual(counts['trips'], Trip.objects.count())
+        self.assertEqual(Trip.objects.active().count(), 5)
+        self.assertTrue(Trip.objects.failed_unloads().exists())
+        self.assertEqual(storage_totals_mismatches(), [])
+        for storage in Storage.objects.all():
+            with self.assertRaises(ValidationError):
+                Storage(title='Overlap', territory=storage.territory).validate_unique()
+            self.assertEqual(storage_index.intersecting(storage.territory), [storage.id])
+
+    def test_views_benchmark(self):
+        """ every case is timed with its queries and writes are rolled back """
+        generate(seed=2, scale=self.scale)
+        results = views_benchmark(repeat=1, batch=3)
+        self.assertTrue(all(result['queries'] > 0 for result in results.values()))
+        self.assertEqual(Trip.objects.active().count(), 5)
+
+
+class FactoryResetTest(TestCase):
+    """ tests for the factory reset """
+
+    def test_factory_reset(self):
+        """ tables are truncated and reseeded with consistent totals """
+        TruckModel.objects.create(title='Old', max_weight=10)
+        with CaptureQueriesContext(connection) as queries:
+            factory_reset(reset_admin=False)
+        self.assertLess(len(queries), 30)
+        self.assertFalse(TruckModel.objects.filter(title='Old').exists())
+        self.assertEqual(Trip.objects.active().count(), 3)
+        self.assertEqual(storage_report()[0]['sum_weight_after'], 900)
+        self.assertEqual(storage_totals_mismatches(), [])
+        self.assertEqual(self.client.get(reverse('reset')).status_code, 302)
+
+    def test_scale(self):
+        """ synthetic data is added after the default data """
+        factory_reset(reset_admin=False, scale=Scale(truck_models=1, trucks=2, storages=2, trips=10, other_incoms=1))
+        self.assertEqual(Trip.objects.count(), 3 + 10 + 2)
+        self.assertEqual(storage_totals_mismatches(), [])
+        out = StringIO()
+        call_command('factory_reset', '--keep-admin', stdout=out, stderr=StringIO())
+        self.assertEqual(Trip.objects.count(), 3)
+
+
+class SnapshotTest(TestCase):
+    """ tests for named snapshots of pit tables """
+
+    def setUp(self):
+        factory_reset(reset_admin=False)
+
+    def test_restore(self):
+        """ a restored snapshot replaces all pit data """
+        snapshot = create_snapshot('qa')
+        self.assertEqual(snapshot['rows']['trip'], 3)
+        self.assertEqual([s['name'] for s in list_snapshots()], ['qa'])
+        trip = Trip.objects.active().first()
+        trip.xy = '20 20'
+        trip.save()
+        TruckModel.objects.create(title='New', max_weight=50)
+        restore_snapshot('qa')
+        self.assertEqual(Trip.objects.active().count(), 3)
+        self.assertFalse(TruckModel.objects.filter(title='New').exists())
+        self.assertEqual(storage_totals_mismatches(), [])
+        self.assertEqual(Truck.objects.get(number='101').max_weight, 120)
+        TruckModel.objects.create(title='New', max_weight=50)  # sequences continue after copied ids
+        with self.assertRaises(SnapshotError):
+            create_snapshot('qa')
+        delete_snapshot('qa')
+        self.assertEqual(list_snapshots(), [])
+
+    def test_errors(self):
+        """ invalid names, missing snapshots and snapshots of other migrations are rejected """
+        with self.assertRaises(SnapshotError):
+            create_snapshot('QA; DROP')
+        with self.assertRaises(SnapshotError):
+            restore_snapshot('missing')
+        create_snapshot('old')
+        with mock.patch('pit.snapshots.pit_migration', return_value='9999_future'):
+            with self.assertRaises(SnapshotError):
+                restore_snapshot('old')
+
+    def test_reset_view(self):
+        """ the reset page restores the configured snapshot """
+        create_snapshot('training')
+        Trip.objects.all().delete()
+        with mock.patch('pit.views.RESET_SNAPSHOT', 'training'):
+            self.client.get(reverse('reset'))
+        self.assertEqual(Trip.objects.count(), 3)
+
+
+class PerformanceMiddlewareTest(TestCase):
+    """ Tests of pit.middleware.PerformanceMiddleware """
+
+    def test_disabled(self):
+        """ the middleware is removed from the chain unless PIT_PERFORMANCE is set """
+        with self.assertRaises(MiddlewareNotUsed):
+            PerformanceMiddleware(lambda request: HttpResponse())
+        self.assertNotIn('Server-Timing', self.client.get(reverse('index')))
+
+    @override_settings(PIT_PERFORMANCE=True, PIT_SLOW_REQUEST_MS=0)
+    def test_timings(self):
+        """ statements and render time go to the Server-Timing header and the logs """
+        TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        with self.assertLogs('pit.performance', level='INFO') as logs:
+            response = self.client.get(reverse('index'))
+        timing = response['Server-Timing']
+        for metric in ('sql;dur=', 'tpl;dur=', 'app;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+        line, slow = logs.records
+        self.assertEqual(line.name, 'pit.performance')
+        record = json.loads(line.getMessage())
+        self.assertEqual(record['path'], reverse('index'))
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['sql_count'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertLessEqual(len(record['slowest']), record['sql_count'])
+        self.assertEqual(slow.name, 'pit.performance.slow')
+        self.assertEqual(len(json.loads(slow.getMessage())['queries']), record['sql_count'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MetricsTest(TransactionTestCase):
+    """ tests for the metrics shared by worker processes through files """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = mock.patch('pit.metrics.store', MetricsStore(self.directory, save_interval=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_processes(self):
+        """ values of all processes are summed, histograms have cumulative buckets """
+        other = MetricsStore(self.directory, save_interval=0)
+        metrics.inc(metrics.UNLOADS, 3)
+        other.inc(metrics.UNLOADS, 2)
+        metrics.observe(metrics.REQUEST_DURATION, 0.02, view='Index')
+        other.observe(metrics.REQUEST_DURATION, 3, view='Index')
+        other.observe(metrics.REQUEST_DURATION, 0.02, view='Report')
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        text = metrics.metrics_text()
+        self.assertIn('pit_unloads_total 5\n', text)
+        self.assertIn('pit_overloads_total 0\n', text)
+        self.assertIn('pit_request_duration_seconds_bucket{view="Index",le="0.01"} 0\n', text)
+        self.assertIn('pit_request_duration_seconds_bucket{view="Index",le="0.025"} 1\n', text)
+        self.assertIn('pit_request_duration_seconds_bucket{view="Index",le="+Inf"} 2\n', text)
+        self.assertIn('pit_request_duration_seconds_sum{view="Index"} 3.02\n', text)
+        self.assertIn('pit_request_duration_seconds_count{view="Report"} 1\n', text)
+
+    def test_save_interval(self):
+        """ values are saved once per interval, other processes see them after the save """
+        store = MetricsStore(self.directory, save_interval=60)
+        store.inc(metrics.UNLOADS, 2)
+        store.inc(metrics.UNLOADS, 3)
+        self.assertIn('pit_unloads_total 0\n', metrics.metrics_text())
+        store.save()
+        self.assertIn('pit_unloads_total 5\n', metrics.metrics_text())
+        self.assertIn('pit_unloads_total 5\n', exposition(store.collect()))
+
+    def test_dead_processes(self):
+        """ files of dead processes are folded into the aggregate once """
+        for pid in (1000001, 1000002):
+            with open(os.path.join(self.directory, f'{pid}-dead.json'), 'w') as file:
+                json.dump({metrics.UNLOADS: {'{}': 2}}, file)
+        metrics.inc(metrics.UNLOADS, 1)
+        with mock.patch('pit.metrics.process_alive', lambda pid: pid == os.getpid()):
+            self.assertIn('pit_unloads_total 5\n', metrics.metrics_text())
+            self.assertIn('pit_unloads_total 5\n', metrics.metrics_text())
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.directory) if name.endswith('.json')),
+            sorted(['aggregate.json', os.path.basename(metrics.store._path)])
+        )
+
+    def test_pit_metrics(self):
+        """ unloads, failed unloads, overloads, report recomputes and requests are counted """
+        Storage.objects.create(title='Sklad1', territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))')
+        belaz = TruckModel.objects.create(title='БЕЛАЗ', max_weight=120)
+        trips = [
+            Trip.objects.create(
+                truck=Truck.objects.create(number=f'T{i}', truck_model=belaz),
+                mineral=Mineral.objects.create(weight=weight, sio2=30, fe=65),
+            )
+            for i, weight in enumerate([100, 130, 140])
+        ]
+        record_unloads([
+            (trips[0].id, Point(20, 20), None),
+            (trips[1].id, Point(20, 20), None),
+            (trips[2].id, Point(40, 30), None),
+        ])
+        self.client.get(reverse('report'))
+        self.client.get(reverse('report'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('pit_unloads_total 3\n', text)
+        self.assertIn('pit_failed_unloads_total 1\n', text)
+        self.assertIn('pit_overloads_total 2\n', text)
+        self.assertIn('pit_report_recompute_seconds_count 1\n', text)
+        self.assertIn('pit_request_duration_seconds_count{view="Report"} 2\n', text)
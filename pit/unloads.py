@@ -0,0 +1,78 @@
+"""
+Bulk recording of trip unloads
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from django.contrib.gis.geos import Point
+from django.db import transaction
+from django.utils import timezone
+from pit import metrics
+from pit.models import Trip, StorageTotal
+from pit.spatial import storage_index
+from pit.versions import REPORT, mark_changed
+
+Unload = Tuple[int, Point, Optional[datetime]]  # trip id, unloading point, unloading time
+
+
+class UnloadConflict(Exception):
+    """ Some trips are not active anymore """
+
+    def __init__(self, trip_ids: Sequence[int]) -> None:
+        super().__init__(f'Trips {", ".join(map(str, trip_ids))} are not active')
+        self.trip_ids = trip_ids
+
+
+def count_unloads(trips: Sequence[Trip]) -> None:
+    """ adds committed unloads to the metrics """
+    metrics.inc(metrics.UNLOADS, len(trips))
+    metrics.inc(metrics.FAILED_UNLOADS, sum(1 for trip in trips if trip.storage_id is None))
+    metrics.inc(metrics.OVERLOADS, sum(1 for trip in trips if trip.overload > 0))
+
+
+def record_unloads(unloads: Sequence[Unload], strict: bool = True) -> Tuple[List[Trip], List[int]]:
+    """ unloads active trips in one transaction with one bulk_update.
+    Storages are located in batch and storage totals get one update per storage.
+    Trips which are not active (or repeated) are skipped and their ids returned,
+    with strict=True nothing is saved then and UnloadConflict is raised.
+    Unloading only removes trips from the only_one_truck_with_active_trip
+    partial index, so the constraint holds for any batch.
+    """
+    if not unloads:
+        return [], []
+    storage_ids = storage_index.locate_many([point for _, point, _ in unloads])
+    now = timezone.now()
+    with transaction.atomic():
+        trips: Dict[int, Trip] = Trip.objects.select_for_update(of=('self',)).select_related(
+            'mineral'
+        ).filter(
+            id__in=[trip_id for trip_id, _, _ in unloads],
+            unloading_point__isnull=True,
+        ).in_bulk()
+        unloaded: List[Trip] = []
+        skipped: List[int] = []
+        for (trip_id, point, unloaded_at), storage_id in zip(unloads, storage_ids):
+            trip = trips.pop(trip_id, None)
+            if trip is None:
+                skipped.append(trip_id)
+                continue
+            trip.unloading_point = point
+            trip.storage_id = storage_id
+            trip._storage_point = point
+            trip.unloaded_at = unloaded_at or now
+            unloaded.append(trip)
+        if skipped and strict:
+            raise UnloadConflict(skipped)
+        Trip.objects.bulk_update(unloaded, ['unloading_point', 'storage', 'unloaded_at'])
+        totals: Dict[int, List[int]] = defaultdict(lambda: [0, 0, 0])
+        for trip in unloaded:
+            if trip.storage_id:
+                total = totals[trip.storage_id]
+                total[0] += trip.mineral.weight
+                total[1] += trip.mineral.weight * trip.mineral.sio2
+                total[2] += trip.mineral.weight * trip.mineral.fe
+        for storage_id, (weight, sio2, fe) in totals.items():
+            StorageTotal.objects.add(storage_id, 'trips', weight=weight, sio2=sio2, fe=fe)
+        mark_changed(REPORT)
+        transaction.on_commit(lambda: count_unloads(unloaded))
+    return unloaded, skipped
@@ -0,0 +1,76 @@
+"""
+Bulk upload of unloads of a shift from CSV: truck number, unloading point "x y"
+"""
+import csv
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from pit.ingest import Results, TruckUnload, merge_results, unload_trucks
+from pit.models import xy_point
+
+UPLOAD_CHUNK_SIZE = 1000
+HEADER = 'truck_number'  # the first cell of an optional header row
+
+RowResult = Tuple[int, str, Dict[str, Any]]  # line, truck number, result of unloading
+
+
+def parse_row(row: List[str]) -> TruckUnload:
+    """ returns the unload of a CSV row, raises ValueError for invalid rows """
+    if len(row) != 2:
+        raise ValueError('Expected 2 columns: truck number, "x y"')
+    number = row[0].strip()
+    if not number:
+        raise ValueError('Truck number is required')
+    return number, xy_point(row[1].strip()), None
+
+
+def upload_rows(lines: Iterable[str], chunk_size: int = UPLOAD_CHUNK_SIZE) -> Iterator[RowResult]:
+    """ reads CSV lines by chunks, unloads trips of every chunk with one bulk update,
+    yields results of rows in order, blank rows are skipped
+    """
+    reader = csv.reader(lines)
+    rows = ((reader.line_num, row) for row in reader if any(cell.strip() for cell in row))
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        results: Results = []
+        unloads: List[TruckUnload] = []
+        numbers: List[str] = []
+        for line, row in chunk:
+            numbers.append(row[0].strip())
+            if line == 1 and numbers[-1].lower() == HEADER:
+                results.append({'status': 'header'})
+                continue
+            try:
+                unloads.append(parse_row(row))
+            except ValueError as e:
+                results.append({'status': 'error', 'error': str(e)})
+            else:
+                results.append(None)
+        merged = merge_results(results, iter(unload_trucks(unloads)))
+        for (line, _), number, result in zip(chunk, numbers, merged):
+            result.pop('index')  # the line is the position of the row
+            if result['status'] != 'header':
+                yield line, number, result
+
+
+class UploadReport:
+    """ counts results of rows of an upload, keeps errors up to errors_limit """
+
+    def __init__(self, errors_limit: Optional[int] = None):
+        self.errors_limit = errors_limit
+        self.rows = 0
+        self.unloaded = 0
+        self.failed = 0
+        self.error_count = 0
+        self.errors: List[Tuple[int, str, str]] = []  # line, truck number, error
+
+    def add(self, line: int, number: str, result: Dict[str, Any]) -> None:
+        self.rows += 1
+        if result['status'] == 'ok':
+            self.unloaded += 1
+            self.failed += result['failed']
+            return
+        self.error_count += 1
+        if self.errors_limit is None or len(self.errors) < self.errors_limit:
+            self.errors.append((line, number, result['error']))
@@ -1,8 +1,16 @@
 from django.urls import path
-from pit.views import Index, Report, Reset
+from pit.views import Index, Report, Upload, Export, UnloadEvents, UnloadPackedEvents, UnloadAck, FleetImport, queue_unload_events, Metrics, Reset
 
 urlpatterns = [
     path('', Index.as_view(), name='index'),
     path('report/', Report.as_view(), name='report'),
+    path('upload/', Upload.as_view(), name='upload'),
+    path('export/<str:dataset>.<str:fmt>', Export.as_view(), name='export'),
+    path('api/unloads/', UnloadEvents.as_view(), name='unload_events'),
+    path('api/unloads/packed/', UnloadPackedEvents.as_view(), name='unload_packed_events'),
+    path('api/unloads/queue/', queue_unload_events, name='queue_unload_events'),
+    path('api/unloads/acks/<str:ack>/', UnloadAck.as_view(), name='unload_ack'),
+    path('api/fleet/', FleetImport.as_view(), name='fleet_import'),
+    path('metrics', Metrics.as_view(), name='metrics'),
     path('reset/', Reset.as_view(), name='reset'),
 ]
@@ -1,3 +1,5 @@
+from typing import Optional
+from django.db import connection, transaction
 from .models import (
     TruckModel,
     Truck,
@@ -5,19 +7,31 @@ from .models import (
     Storage,
     OtherStorageIncom,
     Trip,
+    StorageTotal,
 )
 from django.contrib.auth.models import User
+from pit.catalog import catalog
+from pit.spatial import storage_index
+from pit.synthetic import Scale, generate
+from pit.versions import REPORT, mark_changed
 
+PIT_MODELS = (Trip, OtherStorageIncom, StorageTotal, Storage, Mineral, Truck, TruckModel)
 
-def factory_reset(reset_admin=True) -> None:
-    """ reset database to initial state """
+
+def truncate(models=PIT_MODELS) -> None:
+    """ empties tables of the models with one statement, without collecting cascades in Python """
+    tables = ', '.join(connection.ops.quote_name(model._meta.db_table) for model in models)
+    with connection.cursor() as cursor:
+        cursor.execute(f'TRUNCATE {tables} RESTART IDENTITY CASCADE')
+
+
+@transaction.atomic
+def factory_reset(reset_admin=True, scale: Optional[Scale] = None, seed: int = 0) -> None:
+    """ reset database to initial state,
+    with a scale synthetic data of the scale is added (see pit.synthetic)
+    """
     # clear all tables
-    Trip.objects.all().delete()
-    OtherStorageIncom.objects.all().delete()
-    Storage.objects.all().delete()
-    Mineral.objects.all().delete()
-    Truck.objects.all().delete()
-    TruckModel.objects.all().delete()
+    truncate()
 
     if reset_admin:
         User.objects.all().delete()
@@ -33,39 +47,45 @@ def factory_reset(reset_admin=True) -> None:
         admin.save()
 
     # create TruckModels
-    tm_belaz = TruckModel(title='БЕЛАЗ', max_weight=120)
-    tm_belaz.save()
-    tm_komatsu = TruckModel(title='Komatsu', max_weight=110)
-    tm_komatsu.save()
+    tm_belaz, tm_komatsu = TruckModel.objects.bulk_create([
+        TruckModel(title='БЕЛАЗ', max_weight=120),
+        TruckModel(title='Komatsu', max_weight=110),
+    ])
     # create Trucks
-    t_101 = Truck(number=101, truck_model=tm_belaz)
-    t_101.save()
-    t_102 = Truck(number=102, truck_model=tm_belaz)
-    t_102.save()
-    t_K103 = Truck(number='K103', truck_model=tm_komatsu)
-    t_K103.save()
+    t_101, t_102, t_K103 = Truck.objects.bulk_create([
+        Truck(number='101', truck_model=tm_belaz),
+        Truck(number='102', truck_model=tm_belaz),
+        Truck(number='K103', truck_model=tm_komatsu),
+    ])
     # create Minerals
-    m_101 = Mineral(weight=100, sio2=32, fe=67)
-    m_101.save()
-    m_102 = Mineral(weight=125, sio2=30, fe=65)
-    m_102.save()
-    m_K103 = Mineral(weight=120, sio2=35, fe=62)
-    m_K103.save()
-    m_storage = Mineral(weight=900, sio2=34, fe=65)
-    m_storage.save()
+    m_101, m_102, m_K103, m_storage = Mineral.objects.bulk_create([
+        Mineral(weight=100, sio2=32, fe=67),
+        Mineral(weight=125, sio2=30, fe=65),
+        Mineral(weight=120, sio2=35, fe=62),
+        Mineral(weight=900, sio2=34, fe=65),
+    ])
     # create Trips
-    trip_101 = Trip(truck=t_101, mineral=m_101)
-    trip_101.save()
-    trip_102 = Trip(truck=t_102, mineral=m_102)
-    trip_102.save()
-    trip_K103 = Trip(truck=t_K103, mineral=m_K103)
-    trip_K103.save()
+    Trip.objects.bulk_create([
+        Trip(truck=t_101, mineral=m_101),
+        Trip(truck=t_102, mineral=m_102),
+        Trip(truck=t_K103, mineral=m_K103),
+    ])
     # create Storages
-    storage = Storage(
-        title='Склад',
-        territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))',
-    )
-    storage.save()
+    storage, = Storage.objects.bulk_create([
+        Storage(
+            title='Склад',
+            territory='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))',
+        ),
+    ])
     # create OtherStorageIncom
-    storage_incom = OtherStorageIncom(mineral=m_storage, storage=storage)
-    storage_incom.save()
+    OtherStorageIncom.objects.bulk_create([
+        OtherStorageIncom(mineral=m_storage, storage=storage),
+    ])
+    # bulk_create does not send signals, so do what they do
+    StorageTotal.objects.rebuild()
+    storage_index.invalidate()
+    catalog.invalidate()
+    mark_changed(REPORT)
+
+    if scale is not None:
+        generate(seed, scale)
@@ -0,0 +1,40 @@
+"""
+Versions of pit data shared by all processes through the cache.
+Process-local caches compare a version with the one they were built for.
+"""
+import uuid
+from django.core.cache import cache
+from django.db import transaction
+
+STORAGES = 'storages'
+REPORT = 'report'
+CATALOG = 'catalog'
+
+
+def version_key(name: str) -> str:
+    """ returns the cache key of the version """
+    return f'pit:version:{name}'
+
+
+def get_version(name: str) -> str:
+    """ returns the current version of the data """
+    version = cache.get(version_key(name))
+    if version is None:
+        cache.add(version_key(name), uuid.uuid4().hex, timeout=None)
+        version = cache.get(version_key(name))
+    return version
+
+
+def bump_version(name: str) -> None:
+    """ marks the data as changed,
+    every version is a new unique value so concurrent bumps are never lost
+    """
+    cache.set(version_key(name), uuid.uuid4().hex, timeout=None)
+
+
+def mark_changed(name: str) -> None:
+    """ bumps the version now for readers in the current transaction
+    and once more after commit for everybody else
+    """
+    bump_version(name)
+    transaction.on_commit(lambda: bump_version(name))
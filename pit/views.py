@@ -1,110 +1,239 @@
-from typing import Any, Dict
+import codecs
+import csv
+import json
+from typing import Any, Dict, List, Optional, Union
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views import View
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
-from pit.models import Trip, Storage
-from pit.forms import TripIndexPageFormSet
+from django.views.decorators.csrf import csrf_exempt
+from django.http import (
+    HttpRequest,
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+    JsonResponse,
+    Http404,
+)
+from pit.models import Trip
+from pit.forms import TripIndexPageFormSet, TripBoardFilterForm, UnloadsUploadForm
+from pit.board import BoardPage, cursor
 from django.urls import reverse
-from django.db.models import Sum, F, OuterRef, Subquery, Value, TextField
-from django.db.models.functions import Coalesce, Concat, Cast
+from pit.reports import cached_storage_report
+from pit.exports import DATASETS, FORMATS, export
+from pit.fleet import import_fleet
+from pit.ingest import ingest_json_events, merge_results, parse_events, unload_trucks
+from pit.packed import BatchTooLarge, decode
+from pit.uploads import UploadReport, upload_rows
+from pit.writebehind import ack_status, new_ack, unload_queue
+from pit.snapshots import restore_snapshot, snapshot_exists
 from pit.utils import factory_reset
+from pit.metrics import metrics_text
+
+INGEST_MAX_EVENTS = getattr(settings, 'PIT_INGEST_MAX_EVENTS', 10000)
+UPLOAD_ERRORS_SHOWN = 1000
+RESET_SNAPSHOT = getattr(settings, 'PIT_RESET_SNAPSHOT', None)
 
 
 class Index(View):
     """ index page """
 
-    def get(self, request: HttpRequest) -> HttpResponse:
+    def get_context(self, request: HttpRequest, formset: Optional[Any] = None) -> Dict[str, Any]:
+        """ the context of a page of active trips selected by GET parameters """
+        filter_form = TripBoardFilterForm(request.GET or None)
+        page = BoardPage(
+            filter_form.filter(Trip.objects.active().dashboard()),
+            after=cursor(request.GET.get('after')),
+            before=cursor(request.GET.get('before')),
+        )
         context: Dict[str, Any] = {
-            'formset': TripIndexPageFormSet(queryset=Trip.objects.filter(unloading_point__isnull=True))
+            'formset': formset if formset is not None else TripIndexPageFormSet(queryset=page.trips),
+            'filter_form': filter_form,
+            'page': page,
         }
-        return render(request, 'pit/index.html', context)
+        for name, key, value in (('previous_query', 'before', page.previous_before),
+                                 ('next_query', 'after', page.next_after)):
+            if value is not None:
+                query = request.GET.copy()
+                query.pop('after', None)
+                query.pop('before', None)
+                query[key] = str(value)
+                context[name] = query.urlencode()
+        return context
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        return render(request, 'pit/index.html', self.get_context(request))
 
     def post(self, request: HttpRequest) -> HttpResponse:
-        formset = TripIndexPageFormSet(request.POST)
+        # only trips of the posted page are loaded and validated
+        posted_ids = [
+            cursor(value) for key, value in request.POST.items()
+            if key.startswith('form-') and key.endswith('-id')
+        ]
+        formset = TripIndexPageFormSet(
+            request.POST,
+            queryset=Trip.objects.active().dashboard().filter(id__in=[i for i in posted_ids if i])
+        )
         if formset.is_valid():
-            formset.save()
-            return HttpResponseRedirect(reverse('report'))
-        else:
-            context: Dict[str, Any] = {
-                'formset': formset
-            }
-            return render(request, 'pit/index.html', context)
+            formset.bulk_save()
+            if not formset.non_form_errors():
+                return HttpResponseRedirect(reverse('report'))
+        return render(request, 'pit/index.html', self.get_context(request, formset))
 
 
 class Report(View):
     """ results page """
 
     def get(self, request: HttpRequest) -> HttpResponse:
-        weight_before = Coalesce(Sum('otherstorageincom__mineral__weight'), 0)
-        sio2_before = Coalesce(Sum(F('otherstorageincom__mineral__weight') * F('otherstorageincom__mineral__sio2')), 0)
-        fe_before = Coalesce(Sum(F('otherstorageincom__mineral__weight') * F('otherstorageincom__mineral__fe')), 0)
-        weight_after = Subquery(
-            Trip.objects.filter(
-                unloading_point__isnull=False,  # exclude active trips
-                unloading_point__intersects=OuterRef('territory')  # filter by intersection with the storage polygon
-            ).annotate(
-                mineral_weight=F('mineral__weight'),  # add weight field
-                storage=OuterRef('pk')  # add storage id field (for GROUP BY)
-            ).values(
-                'storage'  # GROUP BY storage id
-            ).annotate(
-                total_weight=Coalesce(Sum('mineral_weight'), 0),
-            ).values('total_weight')
-        )
-        sio2_after = Subquery(
-            Trip.objects.filter(
-                unloading_point__isnull=False,  # exclude active trips
-                unloading_point__intersects=OuterRef('territory')  # filter by intersection with the storage polygon
-            ).annotate(
-                mineral_weight=F('mineral__weight'),  # add weight field
-                mineral_sio2=F('mineral__sio2'),  # add sio2 field
-                storage=OuterRef('pk')  # add storage id field (for GROUP BY)
-            ).values(
-                'storage'  # GROUP BY storage id
-            ).annotate(
-                total_sio2=Coalesce(Sum(F('mineral_weight') * F('mineral_sio2')), 0),
-            ).values('total_sio2')
-        )
-        fe_after = Subquery(
-            Trip.objects.filter(
-                unloading_point__isnull=False,  # exclude active trips
-                unloading_point__intersects=OuterRef('territory')  # filter by intersection with the storage polygon
-            ).annotate(
-                mineral_weight=F('mineral__weight'),  # add weight field
-                mineral_fe=F('mineral__fe'),  # add fe field
-                storage=OuterRef('pk')  # add storage id field (for GROUP BY)
-            ).values(
-                'storage'  # GROUP BY storage id
-            ).annotate(
-                total_fe=Coalesce(Sum(F('mineral_weight') * F('mineral_fe')), 0),
-            ).values('total_fe')
-        )
-
-        report = Storage.objects.annotate(
-            weight_before=weight_before,
-            sio2_before=sio2_before,
-            fe_before=fe_before,
-            sum_weight_after=F('weight_before')+weight_after,
-            sum_sio2_after=F('sio2_before')+sio2_after,
-            sum_fe_after=F('fe_before')+fe_after,
-            percent_sio2_after=Coalesce(F('sum_sio2_after')/F('sum_weight_after'), 0),
-            percent_fe_after=Coalesce(F('sum_fe_after')/F('sum_weight_after'), 0),
-            quality_after=Concat(
-                Cast(F('percent_sio2_after'), output_field=TextField()),
-                Cast(Value('% SiO2, '), output_field=TextField()),
-                Cast(F('percent_fe_after'), output_field=TextField()),
-                Cast(Value('% Fe'), output_field=TextField()),
-            )
-        ).values('title', 'weight_before', 'sum_weight_after', 'quality_after')
-
         context: Dict[str, Any] = {
-            'report': report,
+            'report': cached_storage_report(),
         }
         return render(request, 'pit/report.html', context)
 
 
+class Upload(View):
+    """ upload of unloads of a shift from CSV """
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        return render(request, 'pit/upload.html', {'form': UnloadsUploadForm()})
+
+    def post(self, request: HttpRequest) -> HttpResponse:
+        form = UnloadsUploadForm(request.POST, request.FILES)
+        context: Dict[str, Any] = {'form': form}
+        if form.is_valid():
+            # the file is read line by line, rows are unloaded by chunks
+            report = UploadReport(errors_limit=UPLOAD_ERRORS_SHOWN)
+            try:
+                for row in upload_rows(codecs.iterdecode(form.cleaned_data['file'], 'utf-8-sig')):
+                    report.add(*row)
+            except (UnicodeDecodeError, csv.Error) as e:
+                # chunks before the unreadable one are already unloaded and stay in the report
+                form.add_error('file', f'The file is not a readable UTF-8 CSV after {report.rows} rows: {e}')
+            context['report'] = report
+        return render(request, 'pit/upload.html', context)
+
+
+class Export(View):
+    """ streams trips or the storage report as CSV or NDJSON """
+
+    def get(self, request: HttpRequest, dataset: str, fmt: str) -> StreamingHttpResponse:
+        if dataset not in DATASETS or fmt not in FORMATS:
+            raise Http404(f'Unknown export {dataset}.{fmt}')
+        _, content_type = FORMATS[fmt]
+        response = StreamingHttpResponse(export(dataset, fmt), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{dataset}.{fmt}"'
+        return response
+
+
+def read_events(request: HttpRequest) -> Union[List[Any], JsonResponse]:
+    """ returns the list of events of a JSON batch or an error response """
+    try:
+        events = json.loads(request.body)['events']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected {"events": [...]}'}, status=400)
+    if not isinstance(events, list):
+        return JsonResponse({'error': 'events must be a list'}, status=400)
+    if len(events) > INGEST_MAX_EVENTS:
+        return JsonResponse({'error': f'At most {INGEST_MAX_EVENTS} events per batch'}, status=413)
+    return events
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UnloadEvents(View):
+    """ unloads trips by a JSON batch of events of onboard units of trucks:
+    {"events": [{"truck_number": "101", "x": 10.5, "y": 20}, ...]}
+    all events are applied in one transaction, results follow the order of events
+    """
+
+    def post(self, request: HttpRequest) -> JsonResponse:
+        events = read_events(request)
+        if isinstance(events, JsonResponse):
+            return events
+        return JsonResponse({'results': ingest_json_events(events)})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class FleetImport(View):
+    """ imports trucks by JSON: {"trucks": [{"number": "101", "truck_model": "БЕЛАЗ", "max_weight": 120}, ...]},
+    nothing is imported if there are conflicts
+    """
+
+    def post(self, request: HttpRequest) -> JsonResponse:
+        try:
+            trucks = json.loads(request.body)['trucks']
+            sources = [
+                (f'truck {i}', truck.get('number'), truck.get('truck_model'), truck.get('max_weight'))
+                for i, truck in enumerate(trucks)
+            ]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return JsonResponse({'error': 'Expected {"trucks": [{"number", "truck_model", "max_weight"}, ...]}'},
+                                status=400)
+        created, truck_models, conflicts = import_fleet(sources)
+        if conflicts:
+            return JsonResponse({'conflicts': [
+                {'position': position, 'value': value, 'error': error} for position, value, error in conflicts
+            ]}, status=409)
+        return JsonResponse({'trucks': len(created), 'truck_models': len(truck_models)}, status=201)
+
+
+async def queue_unload_events(request: HttpRequest) -> JsonResponse:
+    """ acknowledges a JSON batch of events at once, valid events are queued
+    for unloading by the write-behind thread, results are available by the acknowledgement id
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    events = read_events(request)
+    if isinstance(events, JsonResponse):
+        return events
+    results, unloads = parse_events(events, unloaded_at=timezone.now())
+    ack = await sync_to_async(new_ack)(results)
+    unload_queue.put(ack, results, unloads)
+    return JsonResponse({'ack': ack, 'status_url': reverse('unload_ack', args=[ack])}, status=202)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UnloadPackedEvents(View):
+    """ unloads trips by a binary packed batch of events of the telemetry gateway (see pit.packed) """
+
+    def post(self, request: HttpRequest) -> JsonResponse:
+        try:
+            unloads = decode(request.body, max_count=INGEST_MAX_EVENTS)
+        except BatchTooLarge as e:
+            return JsonResponse({'error': str(e)}, status=413)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        results = unload_trucks(unloads, by='id')
+        return JsonResponse({'results': merge_results([None] * len(results), iter(results))})
+
+
+# csrf_exempt() of Django 3.2 wraps a coroutine function into a sync one, the flag is set directly
+queue_unload_events.csrf_exempt = True  # type: ignore
+
+
+class UnloadAck(View):
+    """ status of a queued batch of unload events """
+
+    def get(self, request: HttpRequest, ack: str) -> JsonResponse:
+        status = ack_status(ack)
+        if status is None:
+            raise Http404(f'Unknown acknowledgement {ack}')
+        return JsonResponse(status)
+
+
+class Metrics(View):
+    """ metrics of all worker processes in the Prometheus text format """
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        return HttpResponse(metrics_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class Reset(View):
-    """ resets task to initial """
+    """ resets task to initial, to the snapshot PIT_RESET_SNAPSHOT if it is set and exists """
     def get(self, request: HttpRequest) -> HttpResponse:
-        factory_reset(reset_admin=False)
+        if RESET_SNAPSHOT and snapshot_exists(RESET_SNAPSHOT):
+            restore_snapshot(RESET_SNAPSHOT)
+        else:
+            factory_reset(reset_admin=False)
         return HttpResponseRedirect(reverse('index'))
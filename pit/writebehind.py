@@ -0,0 +1,137 @@
+"""
+Write-behind queue of unload events: requests are acknowledged at once,
+a background thread applies queued events in batches
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from pit.ingest import Results, TruckUnload, merge_results, unload_trucks
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SIZE = getattr(settings, 'PIT_INGEST_FLUSH_SIZE', 500)  # events
+FLUSH_INTERVAL = getattr(settings, 'PIT_INGEST_FLUSH_INTERVAL', 0.2)  # seconds
+ACK_TIMEOUT = getattr(settings, 'PIT_INGEST_ACK_TIMEOUT', 3600)  # seconds
+STOP_TIMEOUT = 30  # seconds
+
+Item = Tuple[str, Results, List[TruckUnload]]  # acknowledgement id, errors of invalid events, unloads
+
+
+def ack_key(ack: str) -> str:
+    return f'pit:ack:{ack}'
+
+
+def ack_status(ack: str) -> Optional[Dict[str, Any]]:
+    """ returns the status of an acknowledged batch, shared by processes through the cache """
+    return cache.get(ack_key(ack))
+
+
+def new_ack(results: Results) -> str:
+    """ stores the status of a new batch waiting for unloading, returns its acknowledgement id """
+    ack = uuid.uuid4().hex
+    status: Dict[str, Any] = {'status': 'queued'}
+    if None not in results:  # nothing to unload
+        status = {'status': 'done', 'results': merge_results(results, iter([]))}
+    cache.set(ack_key(ack), status, timeout=ACK_TIMEOUT)
+    return ack
+
+
+class WriteBehindQueue:
+    """ in-process queue of batches of unload events.
+    A daemon thread takes batches from the queue until FLUSH_SIZE events are collected
+    or FLUSH_INTERVAL passed and unloads them in one transaction
+    """
+
+    def __init__(self, flush_size: int = FLUSH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 autostart: bool = True):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.autostart = autostart
+        self._queue: 'queue.Queue[Optional[Item]]' = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def put(self, ack: str, results: Results, unloads: List[TruckUnload]) -> None:
+        if not unloads:
+            return
+        if self.autostart:
+            self.start()
+        self._queue.put((ack, results, unloads))
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='pit-write-behind', daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        """ flushes queued events and stops the thread, used on shutdown """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(STOP_TIMEOUT)
+        self.drain()
+
+    def drain(self) -> None:
+        """ flushes queued events in the calling thread """
+        while True:
+            batch, _ = self._take(block=False)
+            if not batch:
+                return
+            self._flush(batch)
+
+    def _take(self, block: bool = True) -> Tuple[List[Item], bool]:
+        """ returns a batch of queued items and whether the stop was requested,
+        the flush interval starts when the first item of the batch is taken
+        """
+        batch: List[Item] = []
+        size = 0
+        deadline = 0.0
+        while size < self.flush_size:
+            try:
+                if not block:
+                    item = self._queue.get_nowait()
+                elif batch:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                else:
+                    item = self._queue.get()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            if not batch:
+                deadline = time.monotonic() + self.flush_interval
+            batch.append(item)
+            size += len(item[2])
+        return batch, False
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch, stopping = self._take()
+            if batch:
+                self._flush(batch)
+                close_old_connections()
+
+    def _flush(self, batch: List[Item]) -> None:
+        try:
+            unloaded = iter(unload_trucks([unload for _, _, unloads in batch for unload in unloads]))
+            for ack, results, _ in batch:
+                cache.set(ack_key(ack), {'status': 'done', 'results': merge_results(results, unloaded)},
+                          timeout=ACK_TIMEOUT)
+        except Exception as e:
+            logger.exception('Unloading of queued events has failed')
+            for ack, _, _ in batch:
+                cache.set(ack_key(ack), {'status': 'error', 'error': str(e)}, timeout=ACK_TIMEOUT)
+
+
+unload_queue = WriteBehindQueue()
+atexit.register(unload_queue.stop)